@@ -0,0 +1,418 @@
+"""
+Game archive: an append-only store of games with one byte per move and an index from position hash to the
+games that reached the position.
+
+    with ChessArchive.GameArchive("games") as archive:
+        gameID = archive.addGame(gs, tags = {"White": "me", "Black": "engine"})
+        archive.addPGN("games.pgn")
+        archive.buildIndex()
+        for gameID in archive.gamesWith(gs):
+            replayed = archive.game(gameID).gameState()
+
+    python ChessArchive.py import games games.pgn
+    python ChessArchive.py index games
+    python ChessArchive.py query games --fen "<fen>"
+    python ChessArchive.py show games 42
+
+An archive is a directory of four files, all read through mmap:
+    games.dat       MAGIC, then one record per game: GAME_HEADER (flags, result, tags length, plies), the start
+                    snapshot when the game does not start from the initial position, the tags as JSON and one
+                    byte per move, the move's index among the legal moves sorted by Move.encode()
+    games.idx       the offset of every game record in games.dat, the game ID is the position in this file
+    positions.idx   POSITIONS_MAGIC, then (hash, game ID) records sorted by hash, big-endian so that the records
+                    sort as bytes
+    positions.log   (hash, game ID) records of the games added since the last buildIndex, in the order they came
+
+Every position of a game is logged once when the game is added and buildIndex merges the log into the sorted
+index with an external sort, so indexing never replays games. Lookups binary search the index and scan the log.
+A game's offset is written last, games.dat records past the last offset are ignored.
+"""
+import argparse
+import heapq
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+import ChessEngine
+import ChessPGN
+
+MAGIC = b"CHESSAR1"
+POSITIONS_MAGIC = b"CHESSPI1"
+GAME_HEADER = struct.Struct("<BBHH")
+OFFSET = struct.Struct("<Q")
+POSITION = struct.Struct(">QI")
+#flag of a game that starts from its own position
+CUSTOM_START = 1
+RESULT_CODES = {result: code for code, result in enumerate(ChessPGN.RESULTS)}
+#records sorted in memory at a time by buildIndex
+RUN_SIZE = 1 << 20
+
+INITIAL_SNAPSHOT = ChessEngine.GameState().snapshot()
+
+
+"""
+Returns the valid moves of gs in archive order, sorted by their packed encoding so the order does not depend on
+the move generator
+"""
+def orderedMoves(gs):
+    return sorted(gs.getValidMoves(), key = ChessEngine.Move.encode)
+
+
+class ArchiveGame():
+    def __init__(self, gameID, tags, result, start, codes):
+        self.gameID = gameID
+        self.tags = tags
+        self.result = result
+        #snapshot of the start position
+        self.start = start
+        #one byte per move
+        self.codes = codes
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __repr__(self):
+        return "ArchiveGame(%d, %s vs %s, %s)" % (self.gameID, self.tags.get("White", "?"), self.tags.get("Black", "?"),
+                                                  self.result)
+
+    def startPosition(self):
+        return ChessEngine.GameState.fromSnapshot(self.start)
+
+    """
+    Plays the game on a new GameState (or gs), yielding each move after it is made
+    """
+    def replay(self, gs = None):
+        if gs is None:
+            gs = self.startPosition()
+        for code in self.codes:
+            moves = orderedMoves(gs)
+            if code >= len(moves):
+                raise ValueError("corrupt move in game %d" % self.gameID)
+            gs.makeMove(moves[code])
+            yield moves[code]
+
+    """
+    Returns the GameState after the last move of the game
+    """
+    def gameState(self):
+        gs = self.startPosition()
+        for move in self.replay(gs):
+            pass
+        return gs
+
+    def toPGN(self):
+        tags = dict(self.tags)
+        tags["Result"] = self.result
+        return ChessPGN.gameToPGN(self.gameState(), tags)
+
+
+"""
+A read-only mmap of a file that may grow or be replaced, remapped when it has
+"""
+class _MappedFile():
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.data = None
+        self.key = None
+
+    """
+    Returns the current contents, None while the file is missing or empty
+    """
+    def view(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self.close()
+            return None
+        key = (stat.st_ino, stat.st_size)
+        if key != self.key:
+            self.close()
+            self.key = key
+            if stat.st_size:
+                self.file = open(self.path, "rb")
+                self.data = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+        return self.data
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.file.close()
+        self.file = None
+        self.data = None
+        self.key = None
+
+
+class GameArchive():
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok = True)
+        self.gamesPath = os.path.join(directory, "games.dat")
+        self.offsetsPath = os.path.join(directory, "games.idx")
+        self.indexPath = os.path.join(directory, "positions.idx")
+        self.logPath = os.path.join(directory, "positions.log")
+
+        if not os.path.exists(self.gamesPath):
+            with open(self.gamesPath, "wb") as f:
+                f.write(MAGIC)
+        with open(self.gamesPath, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("not a game archive " + str(directory))
+
+        self.games = _MappedFile(self.gamesPath)
+        self.offsets = _MappedFile(self.offsetsPath)
+        self.index = _MappedFile(self.indexPath)
+        self.log = _MappedFile(self.logPath)
+        self.gamesFile = open(self.gamesPath, "ab")
+        self.offsetsFile = open(self.offsetsPath, "ab")
+        self.logFile = open(self.logPath, "ab")
+
+    def __len__(self):
+        self.flush()
+        return os.path.getsize(self.offsetsPath) // OFFSET.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.gamesFile is not None:
+            self.flush()
+            for f in (self.gamesFile, self.offsetsFile, self.logFile):
+                f.close()
+            for mapped in (self.games, self.offsets, self.index, self.log):
+                mapped.close()
+            self.gamesFile = None
+
+    def flush(self):
+        self.gamesFile.flush()
+        self.logFile.flush()
+        self.offsetsFile.flush()
+
+    """
+    Stores the game played in gs (its start position and moveLog) and returns its ID. gs is unwound to the start
+    and replayed, and is left as it was. The result defaults to the state of the final position
+    """
+    def addGame(self, gs, result = None, tags = None):
+        if result is None:
+            gs.getValidMoves()
+            result = ChessPGN.gameResult(gs)
+        tags = {tag: value for tag, value in (tags or {}).items() if tag != "Result"}
+        tagBytes = json.dumps(tags, separators = (",", ":")).encode("utf-8") if tags else b""
+        if len(tagBytes) > 0xffff:
+            raise ValueError("tags too long")
+        if len(gs.moveLog) > 0xffff:
+            raise ValueError("game too long")
+
+        checkMate, staleMate = gs.checkMate, gs.staleMate
+        played = list(gs.moveLog)
+        for move in played:
+            gs.undoMove()
+        start = gs.snapshot()
+        codes = bytearray()
+        hashes = {gs.hash}
+        for move in played:
+            codes.append(orderedMoves(gs).index(move))
+            gs.makeMove(move)
+            hashes.add(gs.hash)
+        gs.checkMate, gs.staleMate = checkMate, staleMate
+
+        flags = 0 if start == INITIAL_SNAPSHOT else CUSTOM_START
+        gameID = len(self)
+        offset = self.gamesFile.tell()
+        self.gamesFile.write(GAME_HEADER.pack(flags, RESULT_CODES.get(result, RESULT_CODES["*"]), len(tagBytes), len(codes)))
+        if flags & CUSTOM_START:
+            self.gamesFile.write(start)
+        self.gamesFile.write(tagBytes)
+        self.gamesFile.write(codes)
+        self.logFile.write(b"".join(POSITION.pack(key, gameID) for key in sorted(hashes)))
+        self.gamesFile.flush()
+        self.logFile.flush()
+        #the offset makes the game visible
+        self.offsetsFile.write(OFFSET.pack(offset))
+        self.offsetsFile.flush()
+        return gameID
+
+    """
+    Adds every game of a PGN source that can be replayed, returns the number added. Games are kept up to the
+    first move that cannot be read
+    """
+    def addPGN(self, source, headerFilter = None):
+        added = 0
+        for game in ChessPGN.readGames(source, headerFilter):
+            if game.movetext is None:
+                continue
+            try:
+                gs = game.startPosition()
+            except ValueError:
+                continue
+            try:
+                for san, move in game.replay(gs):
+                    pass
+            except ValueError:
+                #keep the moves before an unreadable or illegal one
+                pass
+            self.addGame(gs, game.headers.get("Result", "*"), game.headers)
+            added += 1
+        return added
+
+    """
+    Reads game gameID
+    """
+    def game(self, gameID):
+        self.flush()
+        offsets = self.offsets.view()
+        if gameID < 0 or offsets is None or (gameID + 1) * OFFSET.size > len(offsets):
+            raise IndexError("no game %d" % gameID)
+        offset = OFFSET.unpack_from(offsets, gameID * OFFSET.size)[0]
+        data = self.games.view()
+        flags, result, tagsLength, plies = GAME_HEADER.unpack_from(data, offset)
+        offset += GAME_HEADER.size
+        start = INITIAL_SNAPSHOT
+        if flags & CUSTOM_START:
+            start = data[offset:offset + ChessEngine.SNAPSHOT_SIZE]
+            offset += ChessEngine.SNAPSHOT_SIZE
+        tags = json.loads(data[offset:offset + tagsLength].decode("utf-8")) if tagsLength else {}
+        offset += tagsLength
+        return ArchiveGame(gameID, tags, ChessPGN.RESULTS[result], start, data[offset:offset + plies])
+
+    def __iter__(self):
+        for gameID in range(len(self)):
+            yield self.game(gameID)
+
+    """
+    Returns the sorted IDs of the games that reached a position, given as a GameState or a Zobrist hash.
+    A hash collision can add a game that did not
+    """
+    def gamesWith(self, position):
+        key = position.hash if isinstance(position, ChessEngine.GameState) else position
+        self.flush()
+        gameIDs = set()
+
+        index = self.index.view()
+        if index is not None:
+            lo, hi = 0, (len(index) - len(POSITIONS_MAGIC)) // POSITION.size
+            #first record with a hash not below key
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if struct.unpack_from(">Q", index, len(POSITIONS_MAGIC) + mid * POSITION.size)[0] < key:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            offset = len(POSITIONS_MAGIC) + lo * POSITION.size
+            while offset < len(index):
+                recordKey, gameID = POSITION.unpack_from(index, offset)
+                if recordKey != key:
+                    break
+                gameIDs.add(gameID)
+                offset += POSITION.size
+
+        #the log is unsorted, find the key with a byte search and keep the matches on record boundaries
+        log = self.log.view()
+        if log is not None:
+            packed = struct.pack(">Q", key)
+            offset = log.find(packed)
+            while offset >= 0:
+                if offset % POSITION.size == 0:
+                    gameIDs.add(POSITION.unpack_from(log, offset)[1])
+                offset = log.find(packed, offset + 1)
+
+        #log records of a game whose offset was never written are not games
+        count = len(self)
+        return sorted(gameID for gameID in gameIDs if gameID < count)
+
+    """
+    Merges the position log into the sorted index. The log is sorted in runs of runSize records in temporary
+    files, which are merged with the current index into a new index file
+    """
+    def buildIndex(self, runSize = RUN_SIZE):
+        self.flush()
+        log = self.log.view()
+        if log is None:
+            return 0
+        logged = len(log) // POSITION.size
+
+        runs = []
+        try:
+            for first in range(0, logged, runSize):
+                last = min(first + runSize, logged)
+                records = sorted(log[i * POSITION.size:(i + 1) * POSITION.size] for i in range(first, last))
+                run = tempfile.TemporaryFile(dir = self.directory)
+                run.write(b"".join(records))
+                run.flush()
+                runs.append((run, mmap.mmap(run.fileno(), 0, access = mmap.ACCESS_READ)))
+
+            sources = [_records(data) for run, data in runs]
+            index = self.index.view()
+            if index is not None:
+                sources.append(_records(index, len(POSITIONS_MAGIC)))
+            path = self.indexPath + ".tmp"
+            with open(path, "wb") as f:
+                f.write(POSITIONS_MAGIC)
+                batch = []
+                for record in heapq.merge(*sources):
+                    batch.append(record)
+                    if len(batch) >= 65536:
+                        f.write(b"".join(batch))
+                        batch = []
+                f.write(b"".join(batch))
+        finally:
+            for run, data in runs:
+                data.close()
+                run.close()
+
+        self.index.close()
+        os.replace(path, self.indexPath)
+        #positions logged while the index was built would be lost by truncating, the archive is single writer
+        self.log.close()
+        self.logFile.truncate(0)
+        return logged
+
+
+"""
+Yields the POSITION records of a buffer from offset on, as bytes that sort like the records
+"""
+def _records(data, offset = 0):
+    for i in range(offset, len(data), POSITION.size):
+        yield data[i:i + POSITION.size]
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Store games and find the games that reached a position")
+    commands = parser.add_subparsers(dest = "command", required = True)
+    add = commands.add_parser("import", help = "add the games of PGN files")
+    add.add_argument("archive")
+    add.add_argument("pgn", nargs = "+")
+    index = commands.add_parser("index", help = "merge the positions of new games into the index")
+    index.add_argument("archive")
+    query = commands.add_parser("query", help = "list the games that reached a position")
+    query.add_argument("archive")
+    query.add_argument("--fen", default = ChessEngine.INITIAL_FEN)
+    show = commands.add_parser("show", help = "print a game as PGN")
+    show.add_argument("archive")
+    show.add_argument("game", type = int)
+    args = parser.parse_args(argv)
+
+    with GameArchive(args.archive) as archive:
+        if args.command == "import":
+            for path in args.pgn:
+                print("%d games added from %s" % (archive.addPGN(path), path))
+        elif args.command == "index":
+            print("%d positions indexed" % archive.buildIndex())
+        elif args.command == "query":
+            gameIDs = archive.gamesWith(ChessEngine.GameState.fromFEN(args.fen))
+            for gameID in gameIDs:
+                print(archive.game(gameID))
+            print("%d games" % len(gameIDs))
+        else:
+            print(archive.game(args.game).toPGN())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
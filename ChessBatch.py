@@ -0,0 +1,193 @@
+"""
+Batch position analysis. Reads positions from a stream, fans them out over a process pool in chunks and
+writes one JSON result per input line, in input order.
+
+Each input line is either a FEN string or a JSON object with an optional "fen" (defaults to the initial
+position), an optional list of "moves" in coordinate notation played from it, and an optional "id"
+that is copied to the output.
+
+Usage:
+    python ChessBatch.py positions.jsonl -o results.jsonl --workers 16 --depth 3
+"""
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import sys
+
+import ChessEngine
+import ChessSearch
+import ChessTablebase
+
+DEFAULT_CHUNK_SIZE = 64
+
+#chunks in flight per worker before the reader waits for results, this bounds memory on huge inputs
+PENDING_PER_WORKER = 4
+
+#search limits and tablebase of a worker process, set by _initWorker
+_limits = None
+_tablebase = None
+
+
+def _initWorker(limits, tablebaseDir = None):
+    global _limits, _tablebase
+    _limits = limits
+    _tablebase = ChessTablebase.Tablebase(tablebaseDir) if tablebaseDir is not None else None
+
+
+"""
+Plays moves given in coordinate notation ("e2e4", "e7e8n") on gs
+"""
+def playMoves(gs, notations):
+    for notation in notations:
+        move = gs.getMoveIndex().parse(notation)
+        if move is None:
+            raise ValueError("illegal move " + notation)
+        gs.makeMove(move)
+
+
+"""
+Splits an input line into (id, fen, moves), the fields are checked by buildPosition
+"""
+def parseLine(line):
+    line = line.strip()
+    if not line.startswith("{"):
+        return None, line, []
+
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError("input record is not an object")
+    return record.get("id"), record.get("fen", ChessEngine.INITIAL_FEN), record.get("moves", [])
+
+
+"""
+Sets up the position of fen with the moves played, raising ValueError when a field has the wrong type
+"""
+def buildPosition(fen, notations):
+    if not isinstance(fen, str):
+        raise ValueError("fen must be a string")
+    if not isinstance(notations, list) or not all(isinstance(notation, str) for notation in notations):
+        raise ValueError("moves must be a list of strings")
+    gs = ChessEngine.GameState.fromFEN(fen)
+    playMoves(gs, notations)
+    return gs
+
+
+def parsePosition(line):
+    positionID, fen, notations = parseLine(line)
+    return positionID, buildPosition(fen, notations)
+
+
+"""
+Analyses one position and returns the result as a dict. Any failure, from a bad line to a search that raises,
+becomes an error record so one position cannot stop a run
+"""
+def analysePosition(line, limits = None, tablebase = None):
+    try:
+        positionID, fen, notations = parseLine(line)
+    except ValueError as error:
+        return {"error": str(error)}
+
+    try:
+        result = _analyse(fen, notations, limits, tablebase)
+    except Exception as error:
+        result = {"error": str(error) or type(error).__name__}
+    if positionID is not None:
+        result["id"] = positionID
+    return result
+
+
+def _analyse(fen, notations, limits, tablebase):
+    gs = buildPosition(fen, notations)
+    moves = gs.getValidMoves()
+    result = {
+        "legalMoves": len(moves),
+        "inCheck": gs.inCheck(),
+        "checkMate": gs.checkMate,
+        "staleMate": gs.staleMate
+    }
+
+    probe = tablebase.probe(gs) if tablebase is not None else None
+    if probe is not None:
+        result["wdl"], result["dtm"] = probe
+
+    if moves and limits is not None:
+        search = ChessSearch.bestMove(gs, limits, tablebase = tablebase)
+        result["bestMove"] = search.move.getChessNotation()
+        result["eval"] = search.score
+        result["depth"] = search.depth
+        result["nodes"] = search.nodes
+    return result
+
+
+def _analyseChunk(lines):
+    return [json.dumps(analysePosition(line, _limits, _tablebase)) for line in lines]
+
+
+def _chunks(lines, chunkSize):
+    chunk = []
+    for line in lines:
+        if not line.strip():
+            continue
+        chunk.append(line)
+        if len(chunk) == chunkSize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+"""
+Yields the JSON result of every non-blank input line, in input order. At most
+workers * PENDING_PER_WORKER chunks are read ahead of the results being consumed
+"""
+def analyseStream(lines, workers = None, chunkSize = DEFAULT_CHUNK_SIZE, limits = None, tablebaseDir = None):
+    workers = workers if workers is not None else os.cpu_count() or 1
+
+    if workers <= 1:
+        _initWorker(limits, tablebaseDir)
+        for chunk in _chunks(lines, chunkSize):
+            yield from _analyseChunk(chunk)
+        return
+
+    with multiprocessing.Pool(workers, initializer = _initWorker, initargs = (limits, tablebaseDir)) as pool:
+        pending = collections.deque()
+        for chunk in _chunks(lines, chunkSize):
+            pending.append(pool.apply_async(_analyseChunk, (chunk,)))
+            if len(pending) >= workers * PENDING_PER_WORKER:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Analyse a stream of positions into JSONL")
+    parser.add_argument("input", nargs = "?", default = "-", help = "input file, - for stdin")
+    parser.add_argument("-o", "--output", default = "-", help = "output file, - for stdout")
+    parser.add_argument("--workers", type = int, default = None)
+    parser.add_argument("--chunk-size", type = int, default = DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--depth", type = int, help = "search every position to this depth")
+    parser.add_argument("--movetime", type = float, help = "search every position for this many seconds")
+    parser.add_argument("--tablebase", help = "directory of endgame tables to look positions up in")
+    args = parser.parse_args(argv)
+
+    limits = None
+    if args.depth is not None or args.movetime is not None:
+        limits = ChessSearch.SearchLimits(depth = args.depth, movetime = args.movetime)
+
+    source = sys.stdin if args.input == "-" else open(args.input)
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        for result in analyseStream(source, args.workers, args.chunk_size, limits, args.tablebase):
+            out.write(result + "\n")
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
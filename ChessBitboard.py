@@ -0,0 +1,132 @@
+"""
+Bitboard helpers and precomputed attack tables for the move generators.
+Squares are indexed as row*8 + col, so bit 0 is a8 and bit 63 is h1, the same layout as GameState.board
+"""
+
+FULL = (1 << 64) - 1
+
+SQUARE_BB = [1 << sq for sq in range(64)]
+
+FILE_A = sum(1 << (r * 8) for r in range(8))
+FILE_H = FILE_A << 7
+NOT_FILE_A = FULL ^ FILE_A
+NOT_FILE_H = FULL ^ FILE_H
+#a8 is a light square
+LIGHT_SQUARES = sum(1 << sq for sq in range(64) if ((sq >> 3) + (sq & 7)) % 2 == 0)
+DARK_SQUARES = FULL ^ LIGHT_SQUARES
+SQUARE_COORDS = [(sq >> 3, sq & 7) for sq in range(64)]
+
+#directions as (rowdir, coldir), the first four are rook rays, the last four bishop rays
+ROOK_DIRECTIONS = [(1,0), (-1,0), (0,1), (0,-1)]
+BISHOP_DIRECTIONS = [(1,1), (-1,-1), (-1,1), (1,-1)]
+
+
+def _onBoard(r, c):
+    return 0 <= r < 8 and 0 <= c < 8
+
+
+def _leaperTable(offsets):
+    table = []
+    for sq in range(64):
+        r, c = SQUARE_COORDS[sq]
+        bb = 0
+        for dr, dc in offsets:
+            if _onBoard(r + dr, c + dc):
+                bb |= SQUARE_BB[(r + dr) * 8 + c + dc]
+        table.append(bb)
+    return table
+
+
+def _rayTable(rowdir, coldir):
+    table = []
+    for sq in range(64):
+        r, c = SQUARE_COORDS[sq]
+        bb = 0
+        while _onBoard(r + rowdir, c + coldir):
+            r += rowdir
+            c += coldir
+            bb |= SQUARE_BB[r * 8 + c]
+        table.append(bb)
+    return table
+
+
+KNIGHT_ATTACKS = _leaperTable([(-2,-1), (-2,1), (2,-1), (2,1), (-1,-2), (-1,2), (1,-2), (1,2)])
+KING_ATTACKS = _leaperTable([(1,0), (1,-1), (1,1), (0,-1), (0,1), (-1,0), (-1,-1), (-1,1)])
+
+#squares a pawn of the given color attacks from each square
+PAWN_ATTACKS = {
+    "w": _leaperTable([(-1,-1), (-1,1)]),
+    "b": _leaperTable([(1,-1), (1,1)])
+}
+
+#rays pointing to higher square indices find their nearest blocker with the lowest set bit,
+#rays pointing to lower indices with the highest set bit
+RAYS = {d: _rayTable(*d) for d in ROOK_DIRECTIONS + BISHOP_DIRECTIONS}
+_ROOK_RAYS = [(RAYS[d], d[0] > 0 or (d[0] == 0 and d[1] > 0)) for d in ROOK_DIRECTIONS]
+_BISHOP_RAYS = [(RAYS[d], d[0] > 0) for d in BISHOP_DIRECTIONS]
+
+ROOK_RAY_MASK = [RAYS[(1,0)][sq] | RAYS[(-1,0)][sq] | RAYS[(0,1)][sq] | RAYS[(0,-1)][sq] for sq in range(64)]
+BISHOP_RAY_MASK = [RAYS[(1,1)][sq] | RAYS[(-1,-1)][sq] | RAYS[(-1,1)][sq] | RAYS[(1,-1)][sq] for sq in range(64)]
+
+
+def _betweenTable():
+    table = [[0] * 64 for sq in range(64)]
+    for rowdir, coldir in RAYS:
+        for sq in range(64):
+            r, c = SQUARE_COORDS[sq]
+            between = 0
+            while _onBoard(r + rowdir, c + coldir):
+                r += rowdir
+                c += coldir
+                table[sq][r * 8 + c] = between
+                between |= SQUARE_BB[r * 8 + c]
+    return table
+
+
+#squares strictly between two squares on the same rank, file or diagonal, 0 otherwise
+BETWEEN = _betweenTable()
+
+
+"""
+Index of the lowest set bit
+"""
+def lsb(bb):
+    return (bb & -bb).bit_length() - 1
+
+
+"""
+Yields the index of every set bit, lowest first
+"""
+def squares(bb):
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+
+def popCount(bb):
+    return bin(bb).count("1")
+
+
+def _slidingAttacks(sq, occupied, rays):
+    attacks = 0
+    for table, increasing in rays:
+        ray = table[sq]
+        blockers = ray & occupied
+        if blockers:
+            blocker = (blockers & -blockers).bit_length() - 1 if increasing else blockers.bit_length() - 1
+            ray ^= table[blocker]
+        attacks |= ray
+    return attacks
+
+
+def rookAttacks(sq, occupied):
+    return _slidingAttacks(sq, occupied, _ROOK_RAYS)
+
+
+def bishopAttacks(sq, occupied):
+    return _slidingAttacks(sq, occupied, _BISHOP_RAYS)
+
+
+def queenAttacks(sq, occupied):
+    return _slidingAttacks(sq, occupied, _ROOK_RAYS) | _slidingAttacks(sq, occupied, _BISHOP_RAYS)
@@ -0,0 +1,189 @@
+"""
+Opening book: a sorted binary file of (position hash, move, weight) records, memory mapped and binary searched
+so that opening a book costs nothing and a lookup touches only a few pages.
+
+    book = ChessBook.OpeningBook("book.bin")
+    move = book.chooseMove(gs)       # None when the position is not in the book
+
+Books are compiled from PGN collections:
+
+    python ChessBook.py build book.bin games1.pgn games2.pgn --plies 20
+    python ChessBook.py probe book.bin --fen "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1"
+
+File layout: MAGIC, then big-endian records of 8 byte Zobrist hash (GameState.hash), 2 byte Move.encode()
+and 2 byte weight, sorted by hash then move.
+"""
+import argparse
+import collections
+import mmap
+import random
+import struct
+import sys
+
+import ChessEngine
+import ChessPGN
+
+MAGIC = b"CHESSBK1"
+RECORD = struct.Struct(">QHH")
+MAX_WEIGHT = 0xffff
+DEFAULT_PLIES = 20
+
+
+class OpeningBook():
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise ValueError("empty book file " + str(path))
+        if self.data[:len(MAGIC)] != MAGIC or (len(self.data) - len(MAGIC)) % RECORD.size:
+            self.close()
+            raise ValueError("not a book file " + str(path))
+        self.size = (len(self.data) - len(MAGIC)) // RECORD.size
+
+    def __len__(self):
+        return self.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.file.close()
+            self.data = None
+
+    def _hashAt(self, index):
+        return struct.unpack_from(">Q", self.data, len(MAGIC) + index * RECORD.size)[0]
+
+    """
+    Returns the (encoded move, weight) records stored for a position hash
+    """
+    def probe(self, key):
+        lo, hi = 0, self.size
+        #first record with a hash not below key
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._hashAt(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        entries = []
+        offset = len(MAGIC) + lo * RECORD.size
+        while lo < self.size:
+            recordKey, code, weight = RECORD.unpack_from(self.data, offset)
+            if recordKey != key:
+                break
+            entries.append((code, weight))
+            lo += 1
+            offset += RECORD.size
+        return entries
+
+    """
+    Returns the (Move, weight) pairs for gs. Moves that are not legal in gs, which only a hash collision or a
+    corrupt book can produce, are left out when validMoves is given
+    """
+    def moves(self, gs, validMoves = None):
+        entries = self.probe(gs.hash)
+        if not entries:
+            return []
+        if validMoves is not None:
+            legal = {move.encode(): move for move in validMoves}
+            return [(legal[code], weight) for code, weight in entries if code in legal]
+        return [(ChessEngine.Move.fromEncoded(code, gs.board), weight) for code, weight in entries]
+
+    """
+    Picks a book move for gs at random in proportion to the weights, or returns None when gs is out of book
+    """
+    def chooseMove(self, gs, rng = None, validMoves = None):
+        entries = [(move, weight) for move, weight in self.moves(gs, validMoves) if weight > 0]
+        if not entries:
+            return None
+        rng = rng if rng is not None else random
+        pick = rng.randrange(sum(weight for move, weight in entries))
+        for move, weight in entries:
+            pick -= weight
+            if pick < 0:
+                return move
+
+
+"""
+Writes {(hash, encoded move): weight} to a book file, weights are scaled down to fit in 16 bits
+"""
+def writeBook(path, weights):
+    largest = max(weights.values(), default = 0)
+    scale = MAX_WEIGHT / largest if largest > MAX_WEIGHT else 1
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        for (key, code), weight in sorted(weights.items()):
+            f.write(RECORD.pack(key, code, max(1, int(weight * scale))))
+
+
+"""
+Compiles a book from PGN sources (paths or open files): every move played in the first plies of a game is
+weighted 2 for a win of the side that played it, 1 for a draw or unknown result and 0 for a loss.
+Moves seen fewer than minCount times are dropped. Returns the number of records written
+"""
+def buildBook(sources, path, plies = DEFAULT_PLIES, minCount = 1, headerFilter = None):
+    weights = collections.Counter()
+    counts = collections.Counter()
+    for source in sources:
+        for game in ChessPGN.readGames(source, headerFilter):
+            if game.movetext is None:
+                continue
+            result = game.headers.get("Result", "*")
+            try:
+                gs = game.startPosition()
+                for ply, (san, move) in enumerate(game.replay(gs)):
+                    if ply >= plies:
+                        break
+                    #replay has already made the move, so the position it was played from is one back in hashLog
+                    key = (gs.hashLog[-2], move.encode())
+                    won, lost = ("1-0", "0-1") if not gs.whiteToMove else ("0-1", "1-0")
+                    weights[key] += 2 if result == won else 0 if result == lost else 1
+                    counts[key] += 1
+            except ValueError:
+                #keep the moves before an unreadable or illegal one
+                continue
+
+    weights = {key: weight for key, weight in weights.items() if counts[key] >= minCount and weight > 0}
+    writeBook(path, weights)
+    return len(weights)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Build or query an opening book")
+    commands = parser.add_subparsers(dest = "command", required = True)
+    build = commands.add_parser("build", help = "compile a book from PGN files")
+    build.add_argument("book")
+    build.add_argument("pgn", nargs = "+")
+    build.add_argument("--plies", type = int, default = DEFAULT_PLIES)
+    build.add_argument("--min-count", type = int, default = 1)
+    probe = commands.add_parser("probe", help = "list the book moves of a position")
+    probe.add_argument("book")
+    probe.add_argument("--fen", default = ChessEngine.INITIAL_FEN)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        records = buildBook(args.pgn, args.book, args.plies, args.min_count)
+        print("%d records written to %s" % (records, args.book))
+        return 0
+
+    gs = ChessEngine.GameState.fromFEN(args.fen)
+    with OpeningBook(args.book) as book:
+        entries = book.moves(gs, gs.getValidMoves())
+        if not entries:
+            print("not in book")
+        total = sum(weight for move, weight in entries)
+        for move, weight in sorted(entries, key = lambda entry: -entry[1]):
+            print("%-6s %5d %5.1f%%" % (move.getChessNotation(), weight, 100.0 * weight / total))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
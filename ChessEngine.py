@@ -1,10 +1,36 @@
 """
 Handles all the information about the chess game, determines whos turn to move and keeps a move log
 """
+import collections
+import struct
+
+from ChessBitboard import (FULL, NOT_FILE_A, NOT_FILE_H, LIGHT_SQUARES, DARK_SQUARES, SQUARE_BB, SQUARE_COORDS,
+                           KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, ROOK_RAY_MASK, BISHOP_RAY_MASK, BETWEEN, lsb, squares, popCount,
+                           rookAttacks, bishopAttacks, queenAttacks)
+from ChessZobrist import PIECE_KEYS, BLACK_TO_MOVE_KEY, CASTLE_KEYS, ENPASSANT_KEYS, castleMask, computeHash
+import ChessEvaluation
+from ChessEvaluation import MG_TABLE, EG_TABLE, PHASE, computeScores
+
+PIECE_TYPES = ["P", "R", "N", "B", "Q", "K"]
+PROMOTION_PIECES = ["Q", "R", "B", "N"]
+
+
+INITIAL_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+#byte codes of the pieces in a snapshot, followed by flags (side to move, castling), enpassant square and move counters
+PIECE_NAMES = ["--"] + ["w" + piece for piece in PIECE_TYPES] + ["b" + piece for piece in PIECE_TYPES]
+PIECE_CODES = {piece: code for code, piece in enumerate(PIECE_NAMES)}
+SNAPSHOT_STATE = struct.Struct("<BBHH")
+SNAPSHOT_SIZE = 64 + SNAPSHOT_STATE.size
+NO_SQUARE = 255
+
+#positions whose legal moves each GameState remembers
+MOVE_CACHE_SIZE = 4096
+
 
 class GameState():
     def __init__(self):
-        self.board = [
+        board = [
             ['bR', 'bN', 'bB', 'bQ', 'bK', 'bB', 'bN', 'bR'],
             ['bP', 'bP', 'bP', 'bP', 'bP', 'bP', 'bP', 'bP'],
             ['--', '--', '--', '--', '--', '--', '--', '--'],
@@ -14,30 +40,310 @@ class GameState():
             ['wP', 'wP', 'wP', 'wP', 'wP', 'wP', 'wP', 'wP'],
             ['wR', 'wN', 'wB', 'wQ', 'wK', 'wB', 'wN', 'wR']
         ]
+        self.setPosition(board, True, CastleRights(True, True, True, True), ())
 
-        self.whiteToMove = True
+    """
+    Resets all game state to the given position with an empty move log
+    """
+    def setPosition(self, board, whiteToMove, castleRights, enpassantPossible, halfmoveClock = 0, fullmoveNumber = 1):
+        self.board = board
+        self.whiteToMove = whiteToMove
         self.moveLog = []
-        self.whiteKingLocation = (7, 4)
-        self.blackKingLocation = (0, 4)
         self.checkMate = False
         self.staleMate = False
-        self.enpassantPossible = ()
-        self.currentCastlingRights = CastleRights(True, True, True, True)
-        self.castleRightsLog = [CastleRights(self.currentCastlingRights.wks, self.currentCastlingRights.bks, 
-                                             self.currentCastlingRights.wqs, self.currentCastlingRights.bqs)]
-
-        self.moveFunctions = {
-            "P" : self.getPawnMoves,
-            "R" : self.getRookMoves,
-            "N" : self.getKnightMoves,
-            "B" : self.getBishopMoves,
-            "Q" : self.getQueenMoves,
-            "K" : self.getKingMoves
-        }
-    
+        self.enpassantPossible = enpassantPossible
+        self.currentCastlingRights = castleRights
+        #castling rights after every move as 4-bit masks (wks, bks, wqs, bqs)
+        self.castleRightsLog = [castleMask(castleRights)]
+
+        #halfmove clock after every move, reset by captures and pawn moves
+        self.halfmoveLog = [halfmoveClock]
+        #move number of the position the game started from, used by toFEN
+        self.startFullmoveNumber = fullmoveNumber
+
+        #legal moves of recently seen positions by hash, a MoveCache can also be shared between GameStates of one game
+        self.moveCache = MoveCache()
+
+        #legal target squares used by addMoves while getValidMoves is generating, unrestricted otherwise
+        self.checkMask = FULL
+        self.targetMasks = {}
+
+        #one bitboard per piece and per color, kept in sync with self.board
+        self.bitboards = {color + piece: 0 for color in "wb" for piece in PIECE_TYPES}
+        self.colorBitboards = {"w": 0, "b": 0}
+        for r in range(8):
+            for c in range(8):
+                piece = board[r][c]
+                if piece != "--":
+                    self.bitboards[piece] |= SQUARE_BB[r*8 + c]
+                    self.colorBitboards[piece[0]] |= SQUARE_BB[r*8 + c]
+        self.whiteKingLocation = SQUARE_COORDS[lsb(self.bitboards["wK"])] if self.bitboards["wK"] else (-1, -1)
+        self.blackKingLocation = SQUARE_COORDS[lsb(self.bitboards["bK"])] if self.bitboards["bK"] else (-1, -1)
+
+        #zobrist hash of the current position, hashLog holds the hash of every position in the game so far
+        self.enpassantLog = [self.enpassantPossible]
+        self.hash = computeHash(self)
+        self.hashLog = [self.hash]
+
+        #material plus piece-square sums for the middlegame and endgame, and the game phase, kept up to date by setSquare
+        self.mgScore, self.egScore, self.phase = computeScores(self.board)
+
+    """
+    Builds a GameState from a FEN string, raises ValueError if the FEN is malformed or the position is impossible.
+    Skips __init__, so no initial position is built just to be overwritten
+    """
+    @classmethod
+    def fromFEN(cls, fen):
+        fields = fen.split()
+        if len(fields) not in (4, 6):
+            raise ValueError("FEN needs 4 or 6 fields: " + fen)
+        placement, side, castling, enpassant = fields[:4]
+
+        ranks = placement.split("/")
+        if len(ranks) != 8:
+            raise ValueError("FEN needs 8 ranks: " + placement)
+        board = []
+        for rank in ranks:
+            row = []
+            for char in rank:
+                if char in "12345678":
+                    row.extend(["--"] * int(char))
+                elif char.upper() in PIECE_TYPES:
+                    row.append(("w" if char.isupper() else "b") + char.upper())
+                else:
+                    raise ValueError("bad piece " + repr(char) + " in FEN")
+            if len(row) != 8:
+                raise ValueError("FEN rank does not have 8 squares: " + rank)
+            board.append(row)
+
+        if side not in ("w", "b"):
+            raise ValueError("bad side to move in FEN: " + side)
+        if castling != "-" and (not castling or any(char not in "KQkq" for char in castling)):
+            raise ValueError("bad castling field in FEN: " + castling)
+        castleRights = CastleRights("K" in castling, "k" in castling, "Q" in castling, "q" in castling)
+
+        if enpassant == "-":
+            enpassantPossible = ()
+        elif (len(enpassant) == 2 and enpassant[0] in Move.filesToCols and
+              enpassant[1] == ("6" if side == "w" else "3")):
+            enpassantPossible = (Move.ranksToRows[enpassant[1]], Move.filesToCols[enpassant[0]])
+        else:
+            raise ValueError("bad enpassant square in FEN: " + enpassant)
+
+        try:
+            halfmoveClock, fullmoveNumber = (int(fields[4]), int(fields[5])) if len(fields) == 6 else (0, 1)
+        except ValueError:
+            raise ValueError("bad move counters in FEN: " + fen)
+        if halfmoveClock < 0 or fullmoveNumber < 1:
+            raise ValueError("bad move counters in FEN: " + fen)
+
+        gs = cls.__new__(cls)
+        gs.setPosition(board, side == "w", castleRights, enpassantPossible, halfmoveClock, fullmoveNumber)
+        gs.validatePosition()
+        return gs
+
+    """
+    Raises ValueError for positions that can't arise in a game
+    """
+    def validatePosition(self):
+        for color in "wb":
+            if self.bitboards[color + "K"] == 0 or self.bitboards[color + "K"] & (self.bitboards[color + "K"] - 1):
+                raise ValueError("position needs exactly one " + ("white" if color == "w" else "black") + " king")
+        if any(piece[1] == "P" for piece in self.board[0] + self.board[7]):
+            raise ValueError("pawns can't stand on the first or last rank")
+
+        rights = self.currentCastlingRights
+        for right, king, rook, row, col in ((rights.wks, "wK", "wR", 7, 7), (rights.wqs, "wK", "wR", 7, 0),
+                                            (rights.bks, "bK", "bR", 0, 7), (rights.bqs, "bK", "bR", 0, 0)):
+            if right and (self.board[row][4] != king or self.board[row][col] != rook):
+                raise ValueError("castling rights without the king and rook on their starting squares")
+
+        if self.enpassantPossible != ():
+            epRow, epCol = self.enpassantPossible
+            pawnRow = epRow + (1 if self.whiteToMove else -1)
+            if self.board[pawnRow][epCol] != ("b" if self.whiteToMove else "w") + "P" or self.board[epRow][epCol] != "--":
+                raise ValueError("enpassant square without a pawn that just moved two squares")
+
+        #the side that just moved can't have left its king in check
+        enemyKing = self.blackKingLocation if self.whiteToMove else self.whiteKingLocation
+        occupied = self.colorBitboards["w"] | self.colorBitboards["b"]
+        if self.attackersTo(enemyKing[0]*8 + enemyKing[1], "w" if self.whiteToMove else "b", occupied):
+            raise ValueError("the side not to move is in check")
+
+    """
+    Returns the FEN string of the current position
+    """
+    def toFEN(self):
+        ranks = []
+        for row in self.board:
+            rank = ""
+            empty = 0
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += piece[1] if piece[0] == "w" else piece[1].lower()
+            if empty:
+                rank += str(empty)
+            ranks.append(rank)
+
+        rights = self.currentCastlingRights
+        castling = ("K" if rights.wks else "") + ("Q" if rights.wqs else "") + ("k" if rights.bks else "") + ("q" if rights.bqs else "")
+        enpassant = "-"
+        if self.enpassantPossible != ():
+            enpassant = Move.colsToFiles[self.enpassantPossible[1]] + Move.rowsToRanks[self.enpassantPossible[0]]
+
+        return " ".join(["/".join(ranks), "w" if self.whiteToMove else "b", castling or "-", enpassant,
+                         str(self.getHalfmoveClock()), str(self.getFullmoveNumber())])
+
+    """
+    Returns the number of moves since the last capture or pawn move
+    """
+    def getHalfmoveClock(self):
+        return self.halfmoveLog[-1]
+
+    def getFullmoveNumber(self):
+        startWhite = self.whiteToMove == (len(self.moveLog) % 2 == 0)
+        return self.startFullmoveNumber + (len(self.moveLog) + (0 if startWhite else 1)) // 2
+
+    """
+    Returns how often the current position has occurred, counting itself. Only positions since the last capture
+    or pawn move are looked at, none before it can repeat
+    """
+    def repetitionCount(self):
+        last = len(self.hashLog) - 1
+        earliest = max(last - self.halfmoveLog[-1], 0)
+        count = 1
+        for i in range(last - 4, earliest - 1, -2):
+            if self.hashLog[i] == self.hash:
+                count += 1
+        return count
+
+    """
+    Returns the hashes of the positions before the current one that it could still repeat, those since the last
+    capture or pawn move, oldest first. Passed as history to restore/fromSnapshot they let a copy of the position
+    made elsewhere recognise repetitions
+    """
+    def repetitionHistory(self):
+        clock = self.getHalfmoveClock()
+        return self.hashLog[-clock - 1:-1] if clock else []
+
+    """
+    Returns if neither side has the material to ever mate: bare kings, a single minor piece, or only bishops all on one color
+    """
+    def isInsufficientMaterial(self):
+        bitboards = self.bitboards
+        if bitboards["wP"] | bitboards["bP"] | bitboards["wR"] | bitboards["bR"] | bitboards["wQ"] | bitboards["bQ"]:
+            return False
+        knights = bitboards["wN"] | bitboards["bN"]
+        bishops = bitboards["wB"] | bitboards["bB"]
+        if popCount(knights | bishops) <= 1:
+            return True
+        return not knights and (not bishops & LIGHT_SQUARES or not bishops & DARK_SQUARES)
+
+    """
+    Returns why the game is drawn by rule ("threefold repetition", "fifty-move rule", "insufficient material"),
+    or None. Stalemate is flagged by getValidMoves as before
+    """
+    def getDrawReason(self):
+        if self.halfmoveLog[-1] >= 100 and not self.checkMate:
+            return "fifty-move rule"
+        if self.isInsufficientMaterial():
+            return "insufficient material"
+        if self.halfmoveLog[-1] >= 8 and self.repetitionCount() >= 3:
+            return "threefold repetition"
+        return None
+
+    """
+    Returns the position as a compact immutable snapshot: one byte per square followed by the side to move,
+    castling rights, enpassant square and move counters. Snapshots are cheap to keep, compare and send to other processes
+    """
+    def snapshot(self):
+        board = bytes([PIECE_CODES[piece] for row in self.board for piece in row])
+        flags = self.whiteToMove | (castleMask(self.currentCastlingRights) << 1)
+        enpassant = self.enpassantPossible[0]*8 + self.enpassantPossible[1] if self.enpassantPossible != () else NO_SQUARE
+        return board + SNAPSHOT_STATE.pack(flags, enpassant, min(self.getHalfmoveClock(), 0xffff), min(self.getFullmoveNumber(), 0xffff))
+
+    """
+    Resets the game to the position in a snapshot, with an empty move log. history, the hashes of the positions
+    played before it (oldest first, e.g. a tail of hashLog), lets repetitions of those positions be recognised
+    """
+    def restore(self, snapshot, history = None):
+        board = [[PIECE_NAMES[code] for code in snapshot[r*8:r*8 + 8]] for r in range(8)]
+        flags, enpassant, halfmoveClock, fullmoveNumber = SNAPSHOT_STATE.unpack_from(snapshot, 64)
+        castleRights = CastleRights(False, False, False, False)
+        castleRights.setMask(flags >> 1)
+        self.setPosition(board, bool(flags & 1), castleRights, SQUARE_COORDS[enpassant] if enpassant != NO_SQUARE else (),
+                         halfmoveClock, fullmoveNumber)
+        if history:
+            self.hashLog = list(history) + self.hashLog
+
+    @classmethod
+    def fromSnapshot(cls, snapshot, history = None):
+        gs = cls.__new__(cls)
+        gs.restore(snapshot, history)
+        return gs
+
+    """
+    Returns an independent GameState of the current position, without the move history
+    """
+    def clone(self):
+        return self.fromSnapshot(self.snapshot())
+
+    """
+    Puts piece (or "--") on a square, updating the board, the bitboards, the hash and the evaluation sums
+    """
+    def setSquare(self, r, c, piece):
+        sq = r*8 + c
+        bit = SQUARE_BB[sq]
+        old = self.board[r][c]
+        self.hash ^= PIECE_KEYS[old][sq] ^ PIECE_KEYS[piece][sq]
+        self.mgScore += MG_TABLE[piece][sq] - MG_TABLE[old][sq]
+        self.egScore += EG_TABLE[piece][sq] - EG_TABLE[old][sq]
+        self.phase += PHASE[piece] - PHASE[old]
+        if old != "--":
+            self.bitboards[old] ^= bit
+            self.colorBitboards[old[0]] ^= bit
+        if piece != "--":
+            self.bitboards[piece] |= bit
+            self.colorBitboards[piece[0]] |= bit
+        self.board[r][c] = piece
+
+    """
+    Hash of the side to move, castling rights and enpassant square. The enpassant file only counts
+    when a pawn of the side to move could capture there, so otherwise identical positions hash the same
+    """
+    def stateHash(self):
+        h = CASTLE_KEYS[castleMask(self.currentCastlingRights)]
+        if not self.whiteToMove:
+            h ^= BLACK_TO_MOVE_KEY
+        if self.enpassantPossible != ():
+            epRow, epCol = self.enpassantPossible
+            pawns = self.bitboards["wP"] if self.whiteToMove else self.bitboards["bP"]
+            if PAWN_ATTACKS["b" if self.whiteToMove else "w"][epRow*8 + epCol] & pawns:
+                h ^= ENPASSANT_KEYS[epCol]
+        return h
+
+    """
+    Static evaluation in centipawns from the side to move's point of view
+    """
+    def evaluate(self):
+        return ChessEvaluation.evaluate(self)
+
+    """
+    Every evaluation term (material, psqt, mobility, kingSafety, phase, total) from white's point of view
+    """
+    def evaluationBreakdown(self):
+        return ChessEvaluation.breakdown(self)
+
     def makeMove(self, move):
-        self.board[move.startRow][move.startCol] = "--"
-        self.board[move.endRow][move.endCol] = move.pieceMoved
+        #take out the old side, castling and enpassant keys, the new ones go back in at the end
+        self.hash ^= self.stateHash()
+        self.setSquare(move.startRow, move.startCol, "--")
+        self.setSquare(move.endRow, move.endCol, move.pieceMoved)
         self.moveLog.append(move)
         self.whiteToMove = not self.whiteToMove
 
@@ -48,11 +354,11 @@ class GameState():
         
         #pawn promotion
         if move.isPawnPromotion:
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + "Q"
+            self.setSquare(move.endRow, move.endCol, move.pieceMoved[0] + move.promotionChoice)
 
         #enpassant
         if move.isEnpassantMove:
-            self.board[move.startRow][move.endCol] = "--"
+            self.setSquare(move.startRow, move.endCol, "--")
 
         if move.pieceMoved[1] == "P" and abs(move.startRow - move.endRow) == 2:
             self.enpassantPossible = ((move.startRow + move.endRow)//2, move.startCol)
@@ -63,24 +369,28 @@ class GameState():
         if move.isCastleMove:
             #kingside
             if move.endCol - move.startCol == 2:
-                self.board[move.endRow][move.endCol-1] = self.board[move.endRow][move.endCol+1]
-                self.board[move.endRow][move.endCol+1] = "--"
+                self.setSquare(move.endRow, move.endCol-1, self.board[move.endRow][move.endCol+1])
+                self.setSquare(move.endRow, move.endCol+1, "--")
 
             #queenside
             else:
-                self.board[move.endRow][move.endCol+1] = self.board[move.endRow][move.endCol-2]
-                self.board[move.endRow][move.endCol-2] = "--"
+                self.setSquare(move.endRow, move.endCol+1, self.board[move.endRow][move.endCol-2])
+                self.setSquare(move.endRow, move.endCol-2, "--")
 
         self.updateCastleRights(move)
-        self.castleRightsLog.append(CastleRights(self.currentCastlingRights.wks, self.currentCastlingRights.bks, 
-                                             self.currentCastlingRights.wqs, self.currentCastlingRights.bqs))
+        self.castleRightsLog.append(castleMask(self.currentCastlingRights))
+        self.enpassantLog.append(self.enpassantPossible)
+        self.halfmoveLog.append(0 if move.pieceMoved[1] == "P" or move.pieceCaptured != "--" else self.halfmoveLog[-1] + 1)
+
+        self.hash ^= self.stateHash()
+        self.hashLog.append(self.hash)
 
 
     def undoMove(self):
         if len(self.moveLog) != 0:
             move = self.moveLog.pop()
-            self.board[move.startRow][move.startCol] = move.pieceMoved
-            self.board[move.endRow][move.endCol] = move.pieceCaptured
+            self.setSquare(move.startRow, move.startCol, move.pieceMoved)
+            self.setSquare(move.endRow, move.endCol, move.pieceCaptured)
             self.whiteToMove = not self.whiteToMove
 
             if move.pieceMoved == "wK":
@@ -90,28 +400,29 @@ class GameState():
             
             #enpassant
             if move.isEnpassantMove:
-                self.board[move.endRow][move.endCol] = "--"
-                self.board[move.startRow][move.endCol] = move.pieceCaptured
-                self.enpassantPossible = (move.endRow, move.endCol)
-                
-            
-            if move.pieceMoved[1] == "P" and abs(move.startRow - move.endRow) == 2:
-                self.enpassantPossible = ()
+                self.setSquare(move.endRow, move.endCol, "--")
+                self.setSquare(move.startRow, move.endCol, move.pieceCaptured)
+
+            self.enpassantLog.pop()
+            self.enpassantPossible = self.enpassantLog[-1]
+            self.halfmoveLog.pop()
 
 
             #undo castling rights
             self.castleRightsLog.pop()
-            newRights = self.castleRightsLog[-1]
-            self.currentCastlingRights = CastleRights(newRights.wks, newRights.bks, newRights.wqs, newRights.bqs)
+            self.currentCastlingRights.setMask(self.castleRightsLog[-1])
 
             #undo castling moves
             if move.isCastleMove:
                 if move.endCol - move.startCol == 2:
-                    self.board[move.endRow][move.endCol+1] = self.board[move.endRow][move.endCol-1]
-                    self.board[move.endRow][move.endCol-1] = "--"
+                    self.setSquare(move.endRow, move.endCol+1, self.board[move.endRow][move.endCol-1])
+                    self.setSquare(move.endRow, move.endCol-1, "--")
                 else:
-                    self.board[move.endRow][move.endCol-2] = self.board[move.endRow][move.endCol+1]
-                    self.board[move.endRow][move.endCol+1] = "--"
+                    self.setSquare(move.endRow, move.endCol-2, self.board[move.endRow][move.endCol+1])
+                    self.setSquare(move.endRow, move.endCol+1, "--")
+
+            self.hashLog.pop()
+            self.hash = self.hashLog[-1]
                     
     def updateCastleRights(self, move):
         #check if king has moved
@@ -149,41 +460,84 @@ class GameState():
             if move.endRow == 0:
                 if move.endCol == 0:
                     self.currentCastlingRights.bqs = False
-                elif move.startCol == 7:
+                elif move.endCol == 7:
                     self.currentCastlingRights.bks = False
                 
                 
+    """
+    Returns the legal moves, from the move cache if the position was seen recently. The list belongs to the
+    caller, the Move objects in it may be shared
+    """
     def getValidMoves(self):
-        #store enpassant and castling markers to reset to original in the end
-        tempEnpassantPossible = self.enpassantPossible
-        tempCastleRights = CastleRights(self.currentCastlingRights.wks, self.currentCastlingRights.bks, self.currentCastlingRights.wqs,
-                                        self.currentCastlingRights.bqs)
-
-        moves = self.getAllPossibleMoves()
+        cached = self.moveCache.get(self.hash)
+        if cached is not None:
+            moves, self.checkMate, self.staleMate = cached[0], cached[1], cached[2]
+            return list(moves)
+        moves = self.generateValidMoves()
+        #the last slot holds the MoveIndex once getMoveIndex has built it
+        self.moveCache.put(self.hash, [tuple(moves), self.checkMate, self.staleMate, None])
+        return moves
 
-        #castling
-        if self.whiteToMove:
-            self.getCastleMoves(self.whiteKingLocation[0], self.whiteKingLocation[1], moves)
+    """
+    Returns the MoveIndex of the valid moves. It is built the first time a position asks for it and kept in the
+    move cache next to the moves, the search never asks so it never pays for it
+    """
+    def getMoveIndex(self):
+        entry = self.moveCache.get(self.hash)
+        if entry is None:
+            entry = [tuple(self.generateValidMoves()), self.checkMate, self.staleMate, None]
+            self.moveCache.put(self.hash, entry)
+        else:
+            self.checkMate, self.staleMate = entry[1], entry[2]
+        if entry[3] is None:
+            entry[3] = MoveIndex(entry[0])
+        return entry[3]
 
+    """
+    Generates only legal moves, bypassing the move cache: checking pieces and pins are worked out once up front,
+    then every generator is restricted to the squares that keep the king safe
+    """
+    def generateValidMoves(self):
+        color, enemy = ("w", "b") if self.whiteToMove else ("b", "w")
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        kingSq = kingRow*8 + kingCol
+        own = self.colorBitboards[color]
+        occupied = own | self.colorBitboards[enemy]
+        checkers = self.attackersTo(kingSq, enemy, occupied)
+
+        #the king may step to any square that is not attacked once it has left its current square
+        attacked = self.attackedSquares(enemy, occupied ^ SQUARE_BB[kingSq])
+        self.targetMasks = {kingSq: KING_ATTACKS[kingSq] & ~attacked}
+
+        if checkers & (checkers - 1):
+            #double check, only the king can move
+            moves = []
+            self.getKingMoves(kingRow, kingCol, moves)
         else:
-            self.getCastleMoves(self.blackKingLocation[0], self.blackKingLocation[1], moves)
-        
-        #remove moves that result in check
-        for i in range(len(moves)-1, -1, -1):
-            self.makeMove(moves[i])
-            self.whiteToMove = not self.whiteToMove
-            
-            #if in check, remove 
-            if self.inCheck():
-                moves.remove(moves[i])
-            
+            #single check, other pieces have to capture the checker or block it
+            if checkers:
+                self.checkMask = BETWEEN[kingSq][lsb(checkers)] | checkers
 
-            self.whiteToMove = not self.whiteToMove
-            self.undoMove()
+            #pinned pieces can only move between the king and the pinning piece
+            snipers = ((ROOK_RAY_MASK[kingSq] & (self.bitboards[enemy + "R"] | self.bitboards[enemy + "Q"])) |
+                       (BISHOP_RAY_MASK[kingSq] & (self.bitboards[enemy + "B"] | self.bitboards[enemy + "Q"])))
+            for sq in squares(snipers):
+                blockers = BETWEEN[kingSq][sq] & occupied
+                if blockers & own and not blockers & (blockers - 1):
+                    self.targetMasks[lsb(blockers)] = (BETWEEN[kingSq][sq] | SQUARE_BB[sq]) & self.checkMask
+
+            moves = self.getAllPossibleMoves()
+
+        self.checkMask = FULL
+        self.targetMasks = {}
+
+        #castling
+        if not checkers:
+            self.getCastleMoves(kingRow, kingCol, moves, attacked)
         
         #if no more moves available, and in check, its checkmate
         if (len(moves) == 0):
-            if self.inCheck():
+            if checkers:
                 self.checkMate = True
             else:
                 self.staleMate = True
@@ -191,9 +545,29 @@ class GameState():
             self.checkMate = False
             self.staleMate = False
         
-        self.enpassantPossible = tempEnpassantPossible
-        self.currentCastlingRights = tempCastleRights
         return moves
+
+    """
+    Returns a bitboard of the pieces of the given color that attack square sq, sliders are blocked by occupied
+    """
+    def attackersTo(self, sq, color, occupied):
+        bitboards = self.bitboards
+        queens = bitboards[color + "Q"]
+        return ((PAWN_ATTACKS["b" if color == "w" else "w"][sq] & bitboards[color + "P"]) |
+                (KNIGHT_ATTACKS[sq] & bitboards[color + "N"]) |
+                (KING_ATTACKS[sq] & bitboards[color + "K"]) |
+                (rookAttacks(sq, occupied) & (bitboards[color + "R"] | queens)) |
+                (bishopAttacks(sq, occupied) & (bitboards[color + "B"] | queens)))
+
+    """
+    Returns if capturing enpassant from fromSq to toSq would leave the mover's own king attacked
+    """
+    def enpassantExposesKing(self, fromSq, toSq):
+        enemy = "b" if self.whiteToMove else "w"
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        capturedBit = SQUARE_BB[(fromSq & ~7) | (toSq & 7)]
+        occupied = ((self.colorBitboards["w"] | self.colorBitboards["b"]) ^ SQUARE_BB[fromSq] ^ capturedBit) | SQUARE_BB[toSq]
+        return self.attackersTo(kingRow*8 + kingCol, enemy, occupied) & ~capturedBit != 0
         
 
     """
@@ -206,192 +580,289 @@ class GameState():
             return self.squareUnderAttack(self.blackKingLocation[0], self.blackKingLocation[1])
             
     """
-    Returns if a given square is under attack
+    Returns if a given square is attacked by the side not to move, looking outwards from the square
+    for sliders, knights, pawns and the king instead of generating the opponent's moves
     """
     def squareUnderAttack(self, r, c):
-        self.whiteToMove = not self.whiteToMove
-        oppMoves = self.getAllPossibleMoves()
-        self.whiteToMove = not self.whiteToMove
+        enemy = "b" if self.whiteToMove else "w"
+        occupied = self.colorBitboards["w"] | self.colorBitboards["b"]
+        return self.attackersTo(r*8 + c, enemy, occupied) != 0
 
-        for move in oppMoves:
-            if move.endRow == r and move.endCol == c:
-                return True
-        
-        return False
+    """
+    Returns a bitboard of every square attacked by the given color, sliders are blocked by occupied
+    (defaults to the current occupancy)
+    """
+    def attackedSquares(self, color, occupied = None):
+        if occupied is None:
+            occupied = self.colorBitboards["w"] | self.colorBitboards["b"]
+        bitboards = self.bitboards
+
+        pawns = bitboards[color + "P"]
+        if color == "w":
+            attacked = ((pawns & NOT_FILE_A) >> 9) | ((pawns & NOT_FILE_H) >> 7)
+        else:
+            attacked = ((pawns & NOT_FILE_A) << 7) | ((pawns & NOT_FILE_H) << 9)
+
+        for sq in squares(bitboards[color + "N"]):
+            attacked |= KNIGHT_ATTACKS[sq]
+        for sq in squares(bitboards[color + "K"]):
+            attacked |= KING_ATTACKS[sq]
+        for sq in squares(bitboards[color + "R"] | bitboards[color + "Q"]):
+            attacked |= rookAttacks(sq, occupied)
+        for sq in squares(bitboards[color + "B"] | bitboards[color + "Q"]):
+            attacked |= bishopAttacks(sq, occupied)
+
+        return attacked & FULL
 
     
     def getAllPossibleMoves(self):
         moves = []
-        for r in range(len(self.board)):
-            for c in range(len(self.board[r])):
-                turn = self.board[r][c][0]
-
-                if (turn == "w" and self.whiteToMove) or (turn == "b" and not self.whiteToMove):
-                    piece = self.board[r][c][1]
-                    self.moveFunctions[piece](r, c, moves)
+        color = "w" if self.whiteToMove else "b"
+        for piece in PIECE_TYPES:
+            bb = self.bitboards[color + piece]
+            generate = self.moveFunctions[piece]
+            while bb:
+                low = bb & -bb
+                bb ^= low
+                r, c = SQUARE_COORDS[low.bit_length() - 1]
+                generate(self, r, c, moves)
 
         return moves
 
+    """
+    Appends a move from (r, c) to every square in the targets bitboard,
+    restricted to the legal target squares while getValidMoves is generating
+    """
+    def addMoves(self, r, c, targets, moves):
+        targets &= self.targetMasks.get(r*8 + c, self.checkMask)
+        while targets:
+            low = targets & -targets
+            targets ^= low
+            moves.append(Move((r, c), SQUARE_COORDS[low.bit_length() - 1], self.board))
+
     def getPawnMoves(self, r, c, moves):
-        #white pawn moves
+        sq = r*8 + c
+        occupied = self.colorBitboards["w"] | self.colorBitboards["b"]
+
+        #white pawns move up the board, black pawns down
         if self.whiteToMove:
-            #one move up
-            if self.board[r-1][c] == "--":
-                moves.append(Move((r,c), (r-1,c), self.board))
-                #two moves up
-                if r == 6 and self.board[r-2][c] == "--":
-                    moves.append(Move((r,c), (r-2,c), self.board))
-
-            #left capture
-            if c-1 >= 0 and self.board[r-1][c-1][0] == "b":
-                moves.append(Move((r,c), (r-1,c-1), self.board))
-            
-            elif c-1 >= 0 and (r-1, c-1) == self.enpassantPossible:
-                moves.append(Move((r,c), (r-1,c-1), self.board, isEnpassantMove = True))
-            
-            #right capture
-            if c+1 < len(self.board[r]) and self.board[r-1][c+1][0] == "b":
-                moves.append(Move((r,c), (r-1,c+1), self.board))
+            step, startRow, enemy = -1, 6, self.colorBitboards["b"]
+        else:
+            step, startRow, enemy = 1, 1, self.colorBitboards["w"]
+
+        #one move up
+        targets = 0
+        if not occupied & SQUARE_BB[sq + 8*step]:
+            targets = SQUARE_BB[sq + 8*step]
+            #two moves up
+            if r == startRow and not occupied & SQUARE_BB[sq + 16*step]:
+                targets |= SQUARE_BB[sq + 16*step]
+
+        #captures
+        attacks = PAWN_ATTACKS["w" if self.whiteToMove else "b"][sq]
+        targets |= attacks & enemy
+
+        #pawn promotion, one move per piece the pawn can become
+        if r + step == 0 or r + step == 7:
+            targets &= self.targetMasks.get(sq, self.checkMask)
+            while targets:
+                low = targets & -targets
+                targets ^= low
+                for piece in PROMOTION_PIECES:
+                    moves.append(Move((r,c), SQUARE_COORDS[low.bit_length() - 1], self.board, promotionChoice = piece))
+        else:
+            self.addMoves(r, c, targets, moves)
 
-            elif c+1 < len(self.board[r]) and (r-1, c+1) == self.enpassantPossible:
-                moves.append(Move((r,c), (r-1,c+1), self.board, isEnpassantMove = True))
-        
-        #black pawn moves
-        if not self.whiteToMove:
-            #one move up
-            if self.board[r+1][c] == "--":
-                moves.append(Move((r,c), (r+1,c), self.board))
-                #two moves up
-                if r == 1 and self.board[r+2][c] == "--":
-                    moves.append(Move((r,c), (r+2,c), self.board))
-
-            #left capture
-            if c-1 >= 0 and self.board[r+1][c-1][0] == "w":
-                moves.append(Move((r,c), (r+1,c-1), self.board))
-
-            elif c-1 >= 0 and (r+1, c-1) == self.enpassantPossible:
-                moves.append(Move((r,c), (r+1,c-1), self.board, isEnpassantMove = True))
-
-            #right capture
-            if c+1 < len(self.board[r]) and self.board[r+1][c+1][0] == "w":
-                moves.append(Move((r,c), (r+1,c+1), self.board))
-            
-            elif c+1 < len(self.board[r]) and (r+1, c+1) == self.enpassantPossible:
-                moves.append(Move((r,c), (r+1,c+1), self.board, isEnpassantMove = True))
+        #enpassant, checked directly since it removes a piece from a second square
+        if self.enpassantPossible != ():
+            epRow, epCol = self.enpassantPossible
+            if attacks & SQUARE_BB[epRow*8 + epCol] and not self.enpassantExposesKing(sq, epRow*8 + epCol):
+                moves.append(Move((r,c), (epRow,epCol), self.board, isEnpassantMove = True))
             
 
     def getRookMoves(self, r, c, moves):
-        positions = [(1,0), (-1,0), (0,1), (0,-1)]
-
-        for pos in positions:
-            rowdir = pos[0]
-            coldir = pos[1]
-
-            row = r
-            col = c
-            while (0 <= row + rowdir < 8) and (0 <= col + coldir < 8):
-                row = row+rowdir
-                col = col+coldir
-                if self.board[row][col] == "--":
-                    moves.append(Move((r, c), (row, col), self.board))
-                elif (self.whiteToMove and self.board[row][col][0] == "b") or (not self.whiteToMove and self.board[row][col][0] == "w"):
-                    moves.append(Move((r,c), (row,col), self.board))
-                    break
-                else:
-                    break
+        own, occupied = self.getOccupancy()
+        self.addMoves(r, c, rookAttacks(r*8 + c, occupied) & ~own, moves)
         
 
     def getKnightMoves(self, r, c, moves):
-        positions = [(r-2, c-1), (r-2, c+1), (r+2, c-1), (r+2, c+1), (r-1, c-2), (r-1, c+2), (r+1, c-2), (r+1, c+2)]
-
-        for pos in positions:
-            endrow = pos[0]
-            endcol = pos[1]
-            if 0 <= endrow < 8:
-                if 0 <= endcol < 8:
-                    if (self.whiteToMove and self.board[endrow][endcol][0] != "w") or (not self.whiteToMove and self.board[endrow][endcol][0] != "b"):
-                        moves.append(Move((r,c), (endrow, endcol), self.board))
+        own = self.colorBitboards["w" if self.whiteToMove else "b"]
+        self.addMoves(r, c, KNIGHT_ATTACKS[r*8 + c] & ~own, moves)
 
 
     def getBishopMoves(self, r, c, moves):
-        positions = [(1,1), (-1, -1), (-1, 1), (1, -1)]
-
-        for pos in positions:
-            rowdir = pos[0]
-            coldir = pos[1]
-
-            row = r
-            col = c
-            while (0 <= row + rowdir < 8) and (0 <= col + coldir < 8):
-                row = row+rowdir
-                col = col+coldir
-                if (self.board[row][col] == "--"):
-                    moves.append(Move((r,c), (row, col), self.board))
-                elif (self.whiteToMove and self.board[row][col][0] == "b") or (not self.whiteToMove and self.board[row][col][0] == "w"):
-                    moves.append(Move((r,c), (row, col), self.board))
-                    break
-                else:
-                    break
+        own, occupied = self.getOccupancy()
+        self.addMoves(r, c, bishopAttacks(r*8 + c, occupied) & ~own, moves)
     
 
     def getQueenMoves(self, r, c, moves):
-        positions = [(1,0), (-1,0), (0,1), (0,-1), (1,1), (-1, -1), (-1, 1), (1, -1)]
-
-        for pos in positions:
-            rowdir = pos[0]
-            coldir = pos[1]
-
-            row = r
-            col = c
-            while (0 <= row + rowdir < 8) and (0 <= col + coldir < 8):
-                row = row+rowdir
-                col = col+coldir
-                if (self.board[row][col] == "--"):
-                    moves.append(Move((r,c), (row, col), self.board))
-                elif (self.whiteToMove and self.board[row][col][0] == "b") or (not self.whiteToMove and self.board[row][col][0] == "w"):
-                    moves.append(Move((r,c), (row, col), self.board))
-                    break
-                else:
-                    break
+        own, occupied = self.getOccupancy()
+        self.addMoves(r, c, queenAttacks(r*8 + c, occupied) & ~own, moves)
 
 
     def getKingMoves(self, r, c, moves):
-        positions = [(r+1, c), (r+1, c-1), (r+1, c+1), (r, c-1), (r, c+1), (r-1, c), (r-1, c-1), (r-1, c+1)]
-        allyColor = "w" if self.whiteToMove else "b"
-
-        for pos in positions:
-            endrow = pos[0]
-            endcol = pos[1]
+        own = self.colorBitboards["w" if self.whiteToMove else "b"]
+        self.addMoves(r, c, KING_ATTACKS[r*8 + c] & ~own, moves)
 
-            if (0 <= endrow < 8) and (0 <= endcol < 8):
-                if (self.whiteToMove and self.board[endrow][endcol][0] != "w") or (not self.whiteToMove and self.board[endrow][endcol][0] != "b"):
-                    moves.append(Move((r,c), (endrow, endcol), self.board))
+    """
+    Returns the side to move's pieces and all pieces as bitboards
+    """
+    def getOccupancy(self):
+        if self.whiteToMove:
+            own = self.colorBitboards["w"]
+        else:
+            own = self.colorBitboards["b"]
+        return own, self.colorBitboards["w"] | self.colorBitboards["b"]
 
 
+    """
+    attacked is the bitboard of squares attacked by the opponent, computed here when not passed in
+    """
+    def getCastleMoves(self, r, c, moves, attacked = None):
+        if attacked is None:
+            attacked = self.attackedSquares("b" if self.whiteToMove else "w")
 
-    def getCastleMoves(self, r, c, moves):
         #if square under attack, can't castle
-        if self.squareUnderAttack(r, c):
+        if attacked & SQUARE_BB[r*8 + c]:
             return
         
         if (self.whiteToMove and self.currentCastlingRights.wks) or (not self.whiteToMove and self.currentCastlingRights.bks):
-            self.getKingsideCastleMoves(r, c, moves)
+            self.getKingsideCastleMoves(r, c, moves, attacked)
 
         if (self.whiteToMove and self.currentCastlingRights.wqs) or (not self.whiteToMove and self.currentCastlingRights.bqs):
-            self.getQueensideCastleMoves(r, c, moves)
+            self.getQueensideCastleMoves(r, c, moves, attacked)
         
     
-    def getKingsideCastleMoves(self, r, c, moves):
+    def getKingsideCastleMoves(self, r, c, moves, attacked):
         if self.board[r][c+1] == "--" and self.board[r][c+2] == "--":
-            if not self.squareUnderAttack(r, c+1) and not self.squareUnderAttack(r, c+2):
+            if not attacked & (SQUARE_BB[r*8 + c+1] | SQUARE_BB[r*8 + c+2]):
                 moves.append(Move((r,c), (r,c+2), self.board, isCastleMove = True))
 
 
-    def getQueensideCastleMoves(self, r, c, moves):
+    def getQueensideCastleMoves(self, r, c, moves, attacked):
         if self.board[r][c-1] == "--" and self.board[r][c-2] == "--" and self.board[r][c-3] == "--":
-            if not self.squareUnderAttack(r, c-1) and not self.squareUnderAttack(r, c-2):
+            if not attacked & (SQUARE_BB[r*8 + c-1] | SQUARE_BB[r*8 + c-2]):
                 moves.append(Move((r,c), (r,c-2), self.board, isCastleMove = True))
 
+    #move generator for each piece type, shared by all instances and called with the GameState as first argument
+    moveFunctions = {
+        "P" : getPawnMoves,
+        "R" : getRookMoves,
+        "N" : getKnightMoves,
+        "B" : getBishopMoves,
+        "Q" : getQueenMoves,
+        "K" : getKingMoves
+    }
+
+
+"""
+Bounded LRU of (moves, checkMate, staleMate) by position hash. getValidMoves hands out copies of the move lists
+"""
+class MoveCache():
+    def __init__(self, size = MOVE_CACHE_SIZE):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.resetStats()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def resetStats(self):
+        self.probes = 0
+        self.hits = 0
+
+    def get(self, key):
+        self.probes += 1
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        if len(self.entries) > self.size:
+            self.entries.popitem(last = False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def hitRate(self):
+        return self.hits / self.probes if self.probes else 0.0
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "entries": len(self.entries),
+            "probes": self.probes,
+            "hits": self.hits,
+            "misses": self.probes - self.hits,
+            "hitRate": self.hitRate()
+        }
+
+
+"""
+The valid moves of a position keyed by start square, by end square and by (start, end) pair, squares as
+(row, col). A pawn promoting on a square has one move per promotion piece under the same pair.
+Iterating gives the moves in generation order
+"""
+class MoveIndex():
+    def __init__(self, moves):
+        self.moves = tuple(moves)
+        self.byStart = {}
+        self.byEnd = {}
+        self.byPair = {}
+        for move in self.moves:
+            start = (move.startRow, move.startCol)
+            end = (move.endRow, move.endCol)
+            self.byStart.setdefault(start, []).append(move)
+            self.byEnd.setdefault(end, []).append(move)
+            self.byPair.setdefault((start, end), []).append(move)
+
+    def __len__(self):
+        return len(self.moves)
+
+    def __iter__(self):
+        return iter(self.moves)
+
+    def movesFrom(self, sq):
+        return self.byStart.get(sq, ())
+
+    def movesTo(self, sq):
+        return self.byEnd.get(sq, ())
+
+    """
+    Returns the valid move from startSq to endSq, or None. promotionChoice picks among promotions and is
+    ignored for other moves
+    """
+    def find(self, startSq, endSq, promotionChoice = "Q"):
+        for move in self.byPair.get((startSq, endSq), ()):
+            if not move.isPawnPromotion or move.promotionChoice == promotionChoice:
+                return move
+        return None
+
+    """
+    Returns the valid move written in coordinate notation ("e2e4", "e7e8n", "e7e8q"), or None.
+    A promotion without a suffix is a queen promotion, as in Move.getChessNotation
+    """
+    def parse(self, notation):
+        notation = notation.lower()
+        if len(notation) not in (4, 5):
+            return None
+        try:
+            startSq = (Move.ranksToRows[notation[1]], Move.filesToCols[notation[0]])
+            endSq = (Move.ranksToRows[notation[3]], Move.filesToCols[notation[2]])
+        except KeyError:
+            return None
+        promotion = notation[4].upper() if len(notation) == 5 else None
+        for move in self.byPair.get((startSq, endSq), ()):
+            if move.isPawnPromotion:
+                if move.promotionChoice == (promotion or "Q"):
+                    return move
+            elif promotion is None:
+                return move
+        return None
+
 
 class CastleRights():
     def __init__ (self, wks, bks, wqs, bqs):
@@ -400,6 +871,12 @@ class CastleRights():
         self.wqs = wqs
         self.bqs = bqs
 
+    def setMask(self, mask):
+        self.wks = bool(mask & 1)
+        self.bks = bool(mask & 2)
+        self.wqs = bool(mask & 4)
+        self.bqs = bool(mask & 8)
+
 
 class Move():
     #map that assigns array pos to a chess pos
@@ -408,27 +885,69 @@ class Move():
     filesToCols = {"a":0, "b":1, "c":2, "d":3, "e":4, "f":5, "g":6, "h":7}
     colsToFiles = {v:k for k, v in filesToCols.items()}
 
-    def __init__(self, startSq, endSq, board, isEnpassantMove = False, isCastleMove = False):
-        self.startRow = startSq[0]
-        self.startCol = startSq[1]
-        self.endRow = endSq[0]
-        self.endCol = endSq[1]
-        self.pieceMoved = board[self.startRow][self.startCol]
-        self.pieceCaptured = board[self.endRow][self.endCol]
+    #moves are created for every pseudo-legal move, so keep them small and derive the rest on demand
+    __slots__ = ("startRow", "startCol", "endRow", "endCol", "pieceMoved", "pieceCaptured", "isEnpassantMove", "isCastleMove",
+                 "promotionChoice")
 
-        #pawn promotion
-        self.isPawnPromotion = (self.pieceMoved == "wP" and self.endRow == 0) or (self.pieceMoved == "bP" and self.endRow == 7)
+    #flag bits of the packed 16-bit encoding, start square in bits 0-5, end square in bits 6-11
+    #and the index of the promotion piece in bits 14-15
+    ENPASSANT_FLAG = 1 << 12
+    CASTLE_FLAG = 1 << 13
+
+    def __init__(self, startSq, endSq, board, isEnpassantMove = False, isCastleMove = False, promotionChoice = "Q"):
+        self.startRow, self.startCol = startSq
+        self.endRow, self.endCol = endSq
+        self.pieceMoved = board[self.startRow][self.startCol]
 
         #enpassant
         self.isEnpassantMove = isEnpassantMove
-        if self.isEnpassantMove:
+        if isEnpassantMove:
             self.pieceCaptured = "wP" if self.pieceMoved == "bP" else "bP"
+        else:
+            self.pieceCaptured = board[self.endRow][self.endCol]
 
         #castling
         self.isCastleMove = isCastleMove
 
-        #unique id
-        self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
+        #piece a promoting pawn turns into, ignored for other moves
+        self.promotionChoice = promotionChoice
+
+    """
+    Rebuilds a move from its packed encoding, board must be the position it is played from
+    """
+    @classmethod
+    def fromEncoded(cls, code, board):
+        start = code & 63
+        end = (code >> 6) & 63
+        return cls((start >> 3, start & 7), (end >> 3, end & 7), board,
+                   isEnpassantMove = bool(code & cls.ENPASSANT_FLAG), isCastleMove = bool(code & cls.CASTLE_FLAG),
+                   promotionChoice = PROMOTION_PIECES[code >> 14])
+
+    #pawn promotion
+    @property
+    def isPawnPromotion(self):
+        return (self.pieceMoved == "wP" and self.endRow == 0) or (self.pieceMoved == "bP" and self.endRow == 7)
+
+    #unique id, underpromotions are offset so that each promotion piece gets its own id
+    @property
+    def moveID(self):
+        moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
+        if self.promotionChoice != "Q" and self.isPawnPromotion:
+            moveID += PROMOTION_PIECES.index(self.promotionChoice) * 10000
+        return moveID
+
+    """
+    Packs the move into 16 bits: start square, end square, the special move flags and the promotion piece
+    """
+    def encode(self):
+        code = (self.startRow * 8 + self.startCol) | ((self.endRow * 8 + self.endCol) << 6)
+        if self.isEnpassantMove:
+            code |= self.ENPASSANT_FLAG
+        if self.isCastleMove:
+            code |= self.CASTLE_FLAG
+        if self.isPawnPromotion:
+            code |= PROMOTION_PIECES.index(self.promotionChoice) << 14
+        return code
 
     """
     Overriding equals operator for checking if a move is the same
@@ -437,9 +956,18 @@ class Move():
         if isinstance(other, Move):
             return self.moveID == other.moveID
         return False
+
+    def __hash__(self):
+        return self.moveID
+
+    def __repr__(self):
+        return "Move(" + self.getChessNotation() + ")"
     
     def getChessNotation(self):
-        return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        notation = self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        if self.promotionChoice != "Q" and self.isPawnPromotion:
+            notation += self.promotionChoice.lower()
+        return notation
     
     """
     Given a row and col, returns file and its row
@@ -0,0 +1,251 @@
+"""
+Static evaluation: material and piece-square tables tapered between middlegame and endgame values,
+plus mobility and king safety. Scores are in centipawns, positive is good for white.
+
+GameState keeps the material and piece-square sums (mgScore, egScore) and the game phase up to date
+in setSquare, so only mobility and king safety are worked out when a position is evaluated
+"""
+from ChessBitboard import (SQUARE_BB, KNIGHT_ATTACKS, KING_ATTACKS, NOT_FILE_A, NOT_FILE_H,
+                           rookAttacks, bishopAttacks, squares, popCount)
+
+#material values, middlegame and endgame
+MG_VALUES = {"P": 82, "N": 337, "B": 365, "R": 477, "Q": 1025, "K": 0}
+EG_VALUES = {"P": 94, "N": 281, "B": 297, "R": 512, "Q": 936, "K": 0}
+
+#how much each piece counts towards the middlegame, a full board is MAX_PHASE
+PHASE_WEIGHTS = {"P": 0, "N": 1, "B": 1, "R": 2, "Q": 4, "K": 0}
+MAX_PHASE = 24
+
+#piece-square tables from white's point of view, laid out like the board (first row is rank 8)
+PAWN_MG = [
+     0,  0,  0,  0,  0,  0,  0,  0,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    10, 10, 20, 30, 30, 20, 10, 10,
+     5,  5, 10, 25, 25, 10,  5,  5,
+     0,  0,  0, 20, 20,  0,  0,  0,
+     5, -5,-10,  0,  0,-10, -5,  5,
+     5, 10, 10,-20,-20, 10, 10,  5,
+     0,  0,  0,  0,  0,  0,  0,  0
+]
+PAWN_EG = [
+     0,  0,  0,  0,  0,  0,  0,  0,
+    80, 80, 80, 80, 80, 80, 80, 80,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    30, 30, 30, 30, 30, 30, 30, 30,
+    15, 15, 15, 15, 15, 15, 15, 15,
+     5,  5,  5,  5,  5,  5,  5,  5,
+     0,  0,  0,  0,  0,  0,  0,  0,
+     0,  0,  0,  0,  0,  0,  0,  0
+]
+KNIGHT = [
+    -50,-40,-30,-30,-30,-30,-40,-50,
+    -40,-20,  0,  0,  0,  0,-20,-40,
+    -30,  0, 10, 15, 15, 10,  0,-30,
+    -30,  5, 15, 20, 20, 15,  5,-30,
+    -30,  0, 15, 20, 20, 15,  0,-30,
+    -30,  5, 10, 15, 15, 10,  5,-30,
+    -40,-20,  0,  5,  5,  0,-20,-40,
+    -50,-40,-30,-30,-30,-30,-40,-50
+]
+BISHOP = [
+    -20,-10,-10,-10,-10,-10,-10,-20,
+    -10,  0,  0,  0,  0,  0,  0,-10,
+    -10,  0,  5, 10, 10,  5,  0,-10,
+    -10,  5,  5, 10, 10,  5,  5,-10,
+    -10,  0, 10, 10, 10, 10,  0,-10,
+    -10, 10, 10, 10, 10, 10, 10,-10,
+    -10,  5,  0,  0,  0,  0,  5,-10,
+    -20,-10,-10,-10,-10,-10,-10,-20
+]
+ROOK = [
+     0,  0,  0,  0,  0,  0,  0,  0,
+     5, 10, 10, 10, 10, 10, 10,  5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+     0,  0,  0,  5,  5,  0,  0,  0
+]
+QUEEN = [
+    -20,-10,-10, -5, -5,-10,-10,-20,
+    -10,  0,  0,  0,  0,  0,  0,-10,
+    -10,  0,  5,  5,  5,  5,  0,-10,
+     -5,  0,  5,  5,  5,  5,  0, -5,
+      0,  0,  5,  5,  5,  5,  0, -5,
+    -10,  5,  5,  5,  5,  5,  0,-10,
+    -10,  0,  5,  0,  0,  0,  0,-10,
+    -20,-10,-10, -5, -5,-10,-10,-20
+]
+KING_MG = [
+    -30,-40,-40,-50,-50,-40,-40,-30,
+    -30,-40,-40,-50,-50,-40,-40,-30,
+    -30,-40,-40,-50,-50,-40,-40,-30,
+    -30,-40,-40,-50,-50,-40,-40,-30,
+    -20,-30,-30,-40,-40,-30,-30,-20,
+    -10,-20,-20,-20,-20,-20,-20,-10,
+     20, 20,  0,  0,  0,  0, 20, 20,
+     20, 30, 10,  0,  0, 10, 30, 20
+]
+KING_EG = [
+    -50,-40,-30,-20,-20,-30,-40,-50,
+    -30,-20,-10,  0,  0,-10,-20,-30,
+    -30,-10, 20, 30, 30, 20,-10,-30,
+    -30,-10, 30, 40, 40, 30,-10,-30,
+    -30,-10, 30, 40, 40, 30,-10,-30,
+    -30,-10, 20, 30, 30, 20,-10,-30,
+    -30,-30,  0,  0,  0,  0,-30,-30,
+    -50,-30,-30,-30,-30,-30,-30,-50
+]
+
+PIECE_SQUARE_MG = {"P": PAWN_MG, "N": KNIGHT, "B": BISHOP, "R": ROOK, "Q": QUEEN, "K": KING_MG}
+PIECE_SQUARE_EG = {"P": PAWN_EG, "N": KNIGHT, "B": BISHOP, "R": ROOK, "Q": QUEEN, "K": KING_EG}
+
+#mobility bonus per reachable square, middlegame and endgame
+MOBILITY_MG = {"N": 4, "B": 5, "R": 2, "Q": 1}
+MOBILITY_EG = {"N": 4, "B": 5, "R": 4, "Q": 2}
+
+#king safety: units per king zone square attacked by each piece type, and the bonus per pawn sheltering the king
+KING_ATTACK_UNITS = {"N": 2, "B": 2, "R": 3, "Q": 5}
+MAX_KING_DANGER = 500
+PAWN_SHIELD_BONUS = 10
+
+
+def _signedTable(values, tables):
+    table = {"--": [0] * 64}
+    for piece in values:
+        table["w" + piece] = [values[piece] + tables[piece][sq] for sq in range(64)]
+        #black reads the table upside down and counts against white
+        table["b" + piece] = [-(values[piece] + tables[piece][(7 - (sq >> 3)) * 8 + (sq & 7)]) for sq in range(64)]
+    return table
+
+
+#MG_TABLE[piece][sq] is material plus piece-square value, negative for black pieces
+MG_TABLE = _signedTable(MG_VALUES, PIECE_SQUARE_MG)
+EG_TABLE = _signedTable(EG_VALUES, PIECE_SQUARE_EG)
+PHASE = {"--": 0}
+PHASE.update({color + piece: weight for color in "wb" for piece, weight in PHASE_WEIGHTS.items()})
+
+
+"""
+Returns the middlegame score, endgame score and phase of a board from scratch
+"""
+def computeScores(board):
+    mg = eg = phase = 0
+    for r in range(8):
+        for c in range(8):
+            piece = board[r][c]
+            mg += MG_TABLE[piece][r*8 + c]
+            eg += EG_TABLE[piece][r*8 + c]
+            phase += PHASE[piece]
+    return mg, eg, phase
+
+
+"""
+Blends the middlegame and endgame scores by phase, rounding toward zero so a position and its color-mirrored twin
+get opposite scores
+"""
+def taper(mg, eg, phase):
+    phase = min(phase, MAX_PHASE)
+    score = mg * phase + eg * (MAX_PHASE - phase)
+    return score // MAX_PHASE if score >= 0 else -(-score // MAX_PHASE)
+
+
+def _pawnAttacks(pawns, color):
+    if color == "w":
+        return ((pawns & NOT_FILE_A) >> 9) | ((pawns & NOT_FILE_H) >> 7)
+    return (((pawns & NOT_FILE_A) << 7) | ((pawns & NOT_FILE_H) << 9)) & ((1 << 64) - 1)
+
+
+"""
+Returns the (middlegame, endgame) mobility and the king danger units inflicted on the enemy king for one color
+"""
+def _activity(gs, color):
+    enemy = "b" if color == "w" else "w"
+    bitboards = gs.bitboards
+    occupied = gs.colorBitboards["w"] | gs.colorBitboards["b"]
+    #squares that are neither our own pieces nor covered by enemy pawns count as mobility
+    available = ~(gs.colorBitboards[color] | _pawnAttacks(bitboards[enemy + "P"], enemy))
+
+    kingSq = bitboards[enemy + "K"].bit_length() - 1
+    kingZone = KING_ATTACKS[kingSq] | SQUARE_BB[kingSq] if kingSq >= 0 else 0
+
+    mg = eg = danger = 0
+    for piece in ("N", "B", "R", "Q"):
+        for sq in squares(bitboards[color + piece]):
+            if piece == "N":
+                attacks = KNIGHT_ATTACKS[sq]
+            elif piece == "B":
+                attacks = bishopAttacks(sq, occupied)
+            elif piece == "R":
+                attacks = rookAttacks(sq, occupied)
+            else:
+                attacks = rookAttacks(sq, occupied) | bishopAttacks(sq, occupied)
+            count = popCount(attacks & available)
+            mg += MOBILITY_MG[piece] * count
+            eg += MOBILITY_EG[piece] * count
+            if attacks & kingZone:
+                danger += KING_ATTACK_UNITS[piece] * popCount(attacks & kingZone)
+    return mg, eg, danger
+
+
+def _pawnShield(gs, color):
+    king = gs.bitboards[color + "K"]
+    if not king:
+        return 0
+    kingRow, kingCol = divmod(king.bit_length() - 1, 8)
+    shieldRow = kingRow - 1 if color == "w" else kingRow + 1
+    if not 0 <= shieldRow < 8:
+        return 0
+    shield = 0
+    for col in range(max(kingCol - 1, 0), min(kingCol + 2, 8)):
+        shield |= SQUARE_BB[shieldRow * 8 + col]
+    return popCount(shield & gs.bitboards[color + "P"])
+
+
+def _kingSafety(danger, shield):
+    return PAWN_SHIELD_BONUS * shield - min(danger * danger // 2, MAX_KING_DANGER)
+
+
+"""
+Returns every evaluation term from white's point of view, tapered to the current phase. The running sum of the
+terms is tapered and each term is what it adds to it, so the terms add up to total exactly and material plus
+psqt is the tapered piece-square score
+"""
+def breakdown(gs):
+    phase = gs.phase
+    mgMaterial = egMaterial = 0
+    for piece in MG_VALUES:
+        count = popCount(gs.bitboards["w" + piece]) - popCount(gs.bitboards["b" + piece])
+        mgMaterial += MG_VALUES[piece] * count
+        egMaterial += EG_VALUES[piece] * count
+
+    whiteMg, whiteEg, whiteDanger = _activity(gs, "w")
+    blackMg, blackEg, blackDanger = _activity(gs, "b")
+    #king safety only matters while there is material left to attack with
+    mgKingSafety = _kingSafety(blackDanger, _pawnShield(gs, "w")) - _kingSafety(whiteDanger, _pawnShield(gs, "b"))
+
+    terms = [("material", mgMaterial, egMaterial), ("psqt", gs.mgScore - mgMaterial, gs.egScore - egMaterial),
+             ("mobility", whiteMg - blackMg, whiteEg - blackEg), ("kingSafety", mgKingSafety, 0)]
+    result = {}
+    mg = eg = tapered = 0
+    for name, mgTerm, egTerm in terms:
+        mg += mgTerm
+        eg += egTerm
+        result[name] = taper(mg, eg, phase) - tapered
+        tapered += result[name]
+    result["phase"] = phase
+    result["total"] = tapered
+    return result
+
+
+"""
+Returns the evaluation from the side to move's point of view
+"""
+def evaluate(gs):
+    phase = gs.phase
+    whiteMg, whiteEg, whiteDanger = _activity(gs, "w")
+    blackMg, blackEg, blackDanger = _activity(gs, "b")
+    kingSafety = _kingSafety(blackDanger, _pawnShield(gs, "w")) - _kingSafety(whiteDanger, _pawnShield(gs, "b"))
+    score = taper(gs.mgScore + whiteMg - blackMg + kingSafety, gs.egScore + whiteEg - blackEg, phase)
+    return score if gs.whiteToMove else -score
@@ -0,0 +1,116 @@
+"""
+Batch feature extraction and evaluation with NumPy, for scoring and training on large numbers of positions.
+
+Positions are given as GameStates or as snapshots (GameState.snapshot()). Snapshots are converted straight from
+their bytes, so a file of concatenated snapshots can be encoded without building a single GameState:
+
+    planes = ChessFeatures.encode(snapshots)            # N x 18 x 8 x 8 uint8
+    scores = ChessFeatures.evaluateBatch(planes)        # N material + piece-square scores
+
+Planes 0-11 hold one piece each in ChessEngine.PIECE_NAMES order (wP wR wN wB wQ wK bP bR bN bB bQ bK),
+followed by side to move (all ones when white is to move), the four castling rights and the enpassant square.
+Row 0 of every plane is rank 8, like GameState.board.
+
+NumPy is only needed by this module, importing it without NumPy works but calling it raises ImportError.
+"""
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import ChessEngine
+from ChessEvaluation import MG_TABLE, EG_TABLE, PHASE, MAX_PHASE
+
+PIECE_PLANES = ChessEngine.PIECE_NAMES[1:]
+SIDE_PLANE = 12
+CASTLE_PLANES = {"wks": 13, "wqs": 14, "bks": 15, "bqs": 16}
+ENPASSANT_PLANE = 17
+NUM_PLANES = 18
+
+#bits of the castling mask in a snapshot's flags byte, see ChessZobrist.castleMask
+_CASTLE_BITS = {"wks": 1, "bks": 2, "wqs": 4, "bqs": 8}
+
+#evaluation weights (middlegame, endgame, phase), each a flat array indexed by piece code * 64 + square, built on first use
+_weights = None
+
+
+def _requireNumpy():
+    if np is None:
+        raise ImportError("ChessFeatures needs numpy")
+
+
+def _evaluationWeights():
+    global _weights
+    if _weights is None:
+        _weights = (
+            np.array([MG_TABLE[piece] for piece in ChessEngine.PIECE_NAMES], dtype = np.int32).reshape(-1),
+            np.array([EG_TABLE[piece] for piece in ChessEngine.PIECE_NAMES], dtype = np.int32).reshape(-1),
+            np.repeat(np.array([PHASE[piece] for piece in ChessEngine.PIECE_NAMES], dtype = np.int32), 64)
+        )
+    return _weights
+
+
+"""
+Returns the snapshots of positions, a sequence of GameStates or snapshots, as an N x SNAPSHOT_SIZE uint8 array
+"""
+def snapshotArray(positions):
+    _requireNumpy()
+    if isinstance(positions, (bytes, bytearray, memoryview)):
+        data = positions
+    else:
+        data = b"".join(position if isinstance(position, (bytes, bytearray)) else position.snapshot() for position in positions)
+    return np.frombuffer(data, dtype = np.uint8).reshape(-1, ChessEngine.SNAPSHOT_SIZE)
+
+
+"""
+Returns the N x NUM_PLANES x 8 x 8 feature planes of positions: GameStates, snapshots,
+concatenated snapshot bytes or an array from snapshotArray
+"""
+def encode(positions):
+    _requireNumpy()
+    snapshots = positions if isinstance(positions, np.ndarray) else snapshotArray(positions)
+    n = len(snapshots)
+    planes = np.zeros((n, NUM_PLANES, 64), dtype = np.uint8)
+
+    #one-hot the piece codes, code 0 (empty) matches no plane
+    codes = snapshots[:, :64]
+    planes[:, :12] = codes[:, None, :] == np.arange(1, 13, dtype = np.uint8)[None, :, None]
+
+    flags = snapshots[:, 64]
+    planes[:, SIDE_PLANE] = (flags & 1)[:, None]
+    for name, plane in CASTLE_PLANES.items():
+        planes[:, plane] = (((flags >> 1) & _CASTLE_BITS[name]) != 0)[:, None]
+
+    enpassant = snapshots[:, 65]
+    rows = np.nonzero(enpassant != ChessEngine.NO_SQUARE)[0]
+    planes[rows, ENPASSANT_PLANE, enpassant[rows]] = 1
+    return planes.reshape(n, NUM_PLANES, 8, 8)
+
+
+"""
+Material plus tapered piece-square score of every position in one pass, positions as for encode or planes from it.
+Scores are from white's point of view, or the side to move's with relative, and equal the material plus psqt
+terms of GameState.evaluationBreakdown
+"""
+def evaluateBatch(positions, relative = False):
+    _requireNumpy()
+    weights = _evaluationWeights()
+    if isinstance(positions, np.ndarray) and positions.ndim == 4:
+        #planes: weigh every piece plane, skipping the empty code 0
+        pieces = positions[:, :12].reshape(len(positions), 12 * 64).astype(np.int32)
+        mg, eg, phase = (pieces @ weights[i][64:] for i in range(3))
+        whiteToMove = positions[:, SIDE_PLANE, 0, 0] == 1
+    else:
+        #snapshots: look the weights up by piece code without building the planes
+        snapshots = positions if isinstance(positions, np.ndarray) else snapshotArray(positions)
+        index = snapshots[:, :64].astype(np.int32) * 64 + np.arange(64, dtype = np.int32)
+        mg, eg, phase = (weights[i][index].sum(axis = 1) for i in range(3))
+        whiteToMove = (snapshots[:, 64] & 1) == 1
+
+    phase = np.minimum(phase, MAX_PHASE)
+    scores = mg * phase + eg * (MAX_PHASE - phase)
+    #round toward zero like ChessEvaluation.taper
+    scores = np.sign(scores) * (np.abs(scores) // MAX_PHASE)
+    if relative:
+        scores = np.where(whiteToMove, scores, -scores)
+    return scores
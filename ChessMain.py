@@ -1,11 +1,26 @@
+import os
+import queue
+import threading
+import time
 import pygame
 import ChessEngine
+import ChessSearch
+import ChessBook
 
 WIDTH = HEIGHT = 400
 DIMENSION = 8
 SQ_SIZE = HEIGHT // DIMENSION
 MAX_FPS = 15
+ANIMATION_FPS = 60
 IMAGES = {}
+NO_MOVES = ChessEngine.MoveIndex(())
+
+#set to False to let the engine play that side
+WHITE_HUMAN = True
+BLACK_HUMAN = True
+AI_LIMITS = ChessSearch.SearchLimits(movetime = 1.0)
+#the engine plays from this opening book while the game is in it, see ChessBook.py
+BOOK_FILE = "book.bin"
 
 """
 Pack the dictionary of images
@@ -18,7 +33,9 @@ def load_images():
 
 
 """
-Handles user input and updating the graphics
+Handles user input and updating the graphics. Move generation and engine searches run on a Worker thread and
+moves are animated a frame at a time, so the loop keeps handling events while either is in progress.
+Press u to undo, r to reset and escape to make a thinking engine play the best move it has found so far
 """
 def main():
     pygame.init()
@@ -26,23 +43,33 @@ def main():
     clock = pygame.time.Clock()
     screen.fill(pygame.Color("white"))
     gs = ChessEngine.GameState()
-    validMoves = gs.getValidMoves()
+    worker = Worker()
+    worker.generateMoves(gs)
+    #filled in when the worker reports back, until then no move can be entered
+    moveIndex = NO_MOVES
+    movesReady = False
     moveMade = False
     animate = False
+    animation = None
+    thinking = False
     gameOver = False
+    drawReason = None
+    book = ChessBook.OpeningBook(BOOK_FILE) if os.path.exists(BOOK_FILE) else None
 
     load_images()
+    renderer = Renderer()
     running = True
 
     sqSelected = ()
     playerClicks = []
 
     while running:
+        humanTurn = (gs.whiteToMove and WHITE_HUMAN) or (not gs.whiteToMove and BLACK_HUMAN)
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
             elif event.type == pygame.MOUSEBUTTONDOWN:
-                if not gameOver:
+                if not gameOver and humanTurn and animation is None:
                     loc = pygame.mouse.get_pos()
                     col = loc[0] // SQ_SIZE
                     row = loc[1] // SQ_SIZE
@@ -57,179 +84,330 @@ def main():
                         
                     #if a move was made, check if valid, then make move if valid
                     if len(playerClicks) == 2:
-                        move = ChessEngine.Move(playerClicks[0], playerClicks[1], gs.board)
-
-                        for i in range(len(validMoves)):
-                            if move == validMoves[i]:
-                                gs.makeMove(validMoves[i])
-                                moveMade = True
-                                animate = True
-                                sqSelected = ()
-                                playerClicks = []
-                        
-                        if not moveMade:
+                        move = moveIndex.find(playerClicks[0], playerClicks[1])
+                        if move is not None:
+                            gs.makeMove(move)
+                            moveMade = True
+                            animate = True
+                            sqSelected = ()
+                            playerClicks = []
+                        else:
                             playerClicks = [sqSelected]
 
             elif event.type == pygame.KEYDOWN:
                 #undo 
-                if event.key == pygame.K_u:
+                if event.key == pygame.K_u and gs.moveLog:
+                    worker.stop()
+                    thinking = False
                     gs.undoMove()
                     moveMade = True
                     animate = False
+                    gameOver = False
 
                 #reset board
                 if event.key == pygame.K_r:
+                    worker.stop()
+                    thinking = False
                     gs = ChessEngine.GameState()
-                    validMoves = gs.getValidMoves()
                     sqSelected = ()
                     playerClicks = []
-                    moveMade = False
+                    moveMade = True
                     animate = False
                     gameOver = False
 
-                     
+                #stop thinking, the engine plays the best move of its last finished iteration
+                if event.key == pygame.K_ESCAPE and thinking:
+                    worker.stop()
+
+        #results for a position that has since been left are dropped by the worker
+        for kind, result in worker.poll(gs):
+            if kind == "moves":
+                moveIndex, gs.checkMate, gs.staleMate, drawReason = result
+                movesReady = True
+            elif kind == "search":
+                thinking = False
+                if result.move is not None:
+                    gs.makeMove(result.move)
+                    moveMade = True
+                    animate = True
+
+        #engine move
+        if not gameOver and not humanTurn and not moveMade and movesReady and not thinking:
+            move = book.chooseMove(gs, validMoves = moveIndex) if book is not None else None
+            if move is None:
+                worker.search(gs, AI_LIMITS)
+                thinking = True
+            else:
+                gs.makeMove(move)
+                moveMade = True
+                animate = True
 
+        rects = []
         if moveMade:
+            if animation is not None:
+                rects += animation.finish(screen, renderer)
+                animation = None
             if animate:
-                animateMove(gs.moveLog[-1], screen, gs.board, clock)
-            validMoves = gs.getValidMoves()
+                rects += renderer.draw(screen, gs, NO_MOVES, (), gs.moveLog[-1])
+                animation = Animation(gs.moveLog[-1], screen, renderer)
+            worker.generateMoves(gs)
+            moveIndex = NO_MOVES
+            movesReady = False
+            drawReason = None
             moveMade = False
             animate = False
-        
-        if len(gs.moveLog) != 0:
-            drawGameState(screen, gs, validMoves, sqSelected, gs.moveLog[-1])
-        else:
-            drawGameState(screen, gs, validMoves, sqSelected, ChessEngine.Move((-1,-1), (-1,-1), gs.board))
 
+        text = None
         if gs.checkMate:
             gameOver = True
-            if gs.whiteToMove:
-                drawText(screen, "Black Won!")
-            else:
-                drawText(screen, "White Won!")
-        elif gs.staleMate:
+            text = "Black Won!" if gs.whiteToMove else "White Won!"
+        elif gs.staleMate or drawReason is not None:
             gameOver = True
-            drawText(screen, "Draw")
-         
-        
-        clock.tick(MAX_FPS)
-        
-        pygame.display.flip()
+            text = "Draw"
 
+        #only the squares that changed are drawn and sent to the display, an idle board costs nothing
+        if animation is not None:
+            rects += animation.step(screen)
+            if animation.done:
+                rects += animation.finish(screen, renderer)
+                animation = None
+        #the labels wait for the piece to land, the animation's background copy does not have them
+        status = "Thinking..." if thinking and animation is None else None
+        text = text if animation is None else None
+        rects += renderer.draw(screen, gs, moveIndex, sqSelected, gs.moveLog[-1] if gs.moveLog else None, text, status)
+        if rects:
+            pygame.display.update(rects)
 
-"""
-Highlights move squares
-"""
-def highlightSquares(screen, gs, validMoves, sqSelected):
-    if sqSelected != ():
-        r, c = sqSelected
-        if gs.board[r][c][0] == ("w" if gs.whiteToMove else "b"):
-
-            #selected square
-            s = pygame.Surface((SQ_SIZE, SQ_SIZE))
-            s.set_alpha(100)
-            s.fill(pygame.Color("yellow"))
-            screen.blit(s, (c*SQ_SIZE, r*SQ_SIZE))
-
-            radius = 8
-            emptySquare = pygame.Surface((SQ_SIZE, SQ_SIZE), pygame.SRCALPHA)
-            pygame.draw.circle(emptySquare, (0, 0, 0, 30), (radius, radius), radius)
-
-            capture_radius = 25
-            captureSquare = pygame.Surface((SQ_SIZE, SQ_SIZE), pygame.SRCALPHA)
-            pygame.draw.circle(captureSquare, (0, 0, 0, 30), (capture_radius, capture_radius), capture_radius)
-
-
-            #moves
-            s.fill(pygame.Color("black"))
-            for move in validMoves:
-                if move.startRow == r and move.startCol == c:
-                    if gs.board[move.endRow][move.endCol] == "--":
-                        screen.blit(emptySquare, (move.endCol*SQ_SIZE + SQ_SIZE//2 - radius, move.endRow*SQ_SIZE + SQ_SIZE//2 - radius))
-                    else:
-                        screen.blit(captureSquare, (move.endCol*SQ_SIZE + SQ_SIZE//2 - capture_radius, move.endRow*SQ_SIZE + SQ_SIZE//2 - capture_radius))
-
-
-def highlightMove(screen, move):
-    s = pygame.Surface((SQ_SIZE, SQ_SIZE))
-    s.set_alpha(100)
-    s.fill(pygame.Color("yellow"))
-    if move.startRow != -1:
-        screen.blit(s, (move.startCol*SQ_SIZE, move.startRow*SQ_SIZE))
-        screen.blit(s, (move.endCol*SQ_SIZE, move.endRow*SQ_SIZE))
+        clock.tick(ANIMATION_FPS if animation is not None else MAX_FPS)
 
 
-    
 """
-Draws the game graphics on the screen
+Runs move generation and engine searches on a daemon thread, one job at a time. Jobs work on their own
+GameState rebuilt from a snapshot, so the UI can keep changing its own. Results carry the move count and hash
+of the position they were asked for and poll hands out only those that still match
 """
-def drawGameState(screen, gs, validMoves, sqSelected, moveMade):
-    drawBoard(screen)
-    highlightSquares(screen, gs, validMoves, sqSelected)
-    highlightMove(screen, moveMade)
-    drawPieces(screen, gs.board)
-
-
-
-def drawBoard(screen):
-    global colors
-    colors = [pygame.Color("white"), pygame.Color("grey")]
-    
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            color = colors[(r+c) % 2]
-            pygame.draw.rect(screen, color, pygame.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-
-
-
-def drawPieces(screen, board):
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            piece = board[r][c]
-            if (piece != "--"):
-                screen.blit(IMAGES[piece], pygame.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-
-
-def animateMove(move, screen, board, clock):
-    global colors
-    dR = move.endRow - move.startRow
-    dC = move.endCol - move.startCol
-    framesPerSquare = 5
-    frameCount = ( abs(dR) + abs(dC) )* framesPerSquare
-
-    for frame in range(frameCount + 1):
-        r, c = (move.startRow + dR*frame/frameCount, move.startCol + dC*frame/frameCount)
-        drawBoard(screen)
-        drawPieces(screen, board)
-
-        #erase piece from its ending square
-        color = colors[(move.endRow + move.endCol) % 2]
-        endSquare = pygame.Rect(move.endCol*SQ_SIZE, move.endRow*SQ_SIZE, SQ_SIZE, SQ_SIZE)
-        pygame.draw.rect(screen, color, endSquare)
-
-        #put captured piece back into original square
-        if move.pieceCaptured != "--":
-            screen.blit(IMAGES[move.pieceCaptured], endSquare)
-
-        #draw moving piece
-        highlightMove(screen, move)
-        screen.blit(IMAGES[move.pieceMoved], pygame.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-        pygame.display.flip()
-        clock.tick(100)
+class Worker():
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        #stop event of the search most recently asked for
+        self.stopEvent = threading.Event()
+        #shared by every position the worker rebuilds, so positions seen again after an undo or redo are not regenerated
+        self.moveCache = ChessEngine.MoveCache()
+        self.thread = threading.Thread(target = self.run, daemon = True)
+        self.thread.start()
+
+    def submit(self, kind, gs, limits = None):
+        self.jobs.put(((len(gs.moveLog), gs.hash), kind, gs.snapshot(), gs.repetitionHistory(), limits, self.stopEvent))
+
+    """
+    Asks for the valid moves of gs, reported as (ChessEngine.MoveIndex, checkMate, staleMate, drawReason)
+    """
+    def generateMoves(self, gs):
+        self.submit("moves", gs)
+
+    """
+    Asks for an engine search of gs, reported as a ChessSearch.SearchResult
+    """
+    def search(self, gs, limits):
+        self.stopEvent = threading.Event()
+        self.submit("search", gs, limits)
+
+    """
+    Makes the running search finish early with the best move found so far. After an undo or reset the result
+    no longer matches the position and poll drops it
+    """
+    def stop(self):
+        self.stopEvent.set()
+
+    """
+    Returns the (kind, result) pairs finished since the last call that belong to the position of gs
+    """
+    def poll(self, gs):
+        finished = []
+        while True:
+            try:
+                key, kind, result = self.results.get_nowait()
+            except queue.Empty:
+                return finished
+            if key == (len(gs.moveLog), gs.hash):
+                finished.append((kind, result))
+
+    def run(self):
+        while True:
+            key, kind, snapshot, history, limits, stopEvent = self.jobs.get()
+            gs = ChessEngine.GameState.fromSnapshot(snapshot, history)
+            gs.moveCache = self.moveCache
+            if kind == "moves":
+                moveIndex = gs.getMoveIndex()
+                result = (moveIndex, gs.checkMate, gs.staleMate, gs.getDrawReason())
+            else:
+                result = ChessSearch.Searcher(gs, limits, stopEvent = stopEvent).search()
+            self.results.put((key, kind, result))
 
 
-def drawText(screen, text):
-    font = pygame.font.SysFont("Helvitica", 32, True, False)
-    textObject = font.render(text, 0, pygame.Color("Black"))
-    textLocation = pygame.Rect(0, 0, WIDTH, HEIGHT).move(WIDTH/2 - textObject.get_width()/2, HEIGHT/2 - textObject.get_height()/2)
+"""
+Draws the board square by square, redrawing only the squares whose contents changed since the last frame.
+The board, highlight and marker surfaces and the font are made once
+"""
+class Renderer():
+    def __init__(self):
+        colors = [pygame.Color("white"), pygame.Color("grey")]
+        self.board = pygame.Surface((WIDTH, HEIGHT))
+        for r in range(DIMENSION):
+            for c in range(DIMENSION):
+                pygame.draw.rect(self.board, colors[(r+c) % 2], pygame.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
+
+        self.highlight = pygame.Surface((SQ_SIZE, SQ_SIZE))
+        self.highlight.set_alpha(100)
+        self.highlight.fill(pygame.Color("yellow"))
+
+        #move markers, a dot on empty squares and a large circle on captures
+        self.markers = {}
+        for marker, radius in (("move", 8), ("capture", 25)):
+            surface = pygame.Surface((SQ_SIZE, SQ_SIZE), pygame.SRCALPHA)
+            pygame.draw.circle(surface, (0, 0, 0, 30), (SQ_SIZE//2, SQ_SIZE//2), radius)
+            self.markers[marker] = surface
+
+        self.font = pygame.font.SysFont("Helvitica", 32, True, False)
+        self.textBox = pygame.Rect(WIDTH//2 - 100, HEIGHT//2 - 75, 200, 150)
+        self.statusFont = pygame.font.SysFont("Helvitica", 20, False, False)
+        self.statusBox = pygame.Rect(WIDTH - 100, HEIGHT - 24, 100, 24)
+        self.invalidate()
+
+    """
+    Forces the next frame to redraw everything
+    """
+    def invalidate(self):
+        self.drawn = [None] * (DIMENSION * DIMENSION)
+        #squares an animation is drawing, left alone until it finishes
+        self.pinned = set()
+        self.text = None
+        self.status = None
+
+    def squareRect(self, r, c):
+        return pygame.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+
+    """
+    Draws one square: board, highlights, marker and piece
+    """
+    def drawSquare(self, screen, r, c, piece, highlighted, marker):
+        rect = self.squareRect(r, c)
+        screen.blit(self.board, rect, rect)
+        if highlighted:
+            screen.blit(self.highlight, rect)
+        if marker is not None:
+            screen.blit(self.markers[marker], rect)
+        if piece != "--":
+            screen.blit(IMAGES[piece], rect)
+        return rect
+
+    def drawText(self, screen, text):
+        textObject = self.font.render(text, 0, pygame.Color("Black"))
+        screen.fill(pygame.Color("white"), self.textBox)
+        screen.blit(textObject, (WIDTH//2 - textObject.get_width()//2, HEIGHT//2 - textObject.get_height()//2))
+
+    def drawStatus(self, screen, status):
+        textObject = self.statusFont.render(status, 0, pygame.Color("Black"))
+        screen.fill(pygame.Color("white"), self.statusBox)
+        screen.blit(textObject, textObject.get_rect(center = self.statusBox.center))
+
+    """
+    Marks the squares under box for redrawing
+    """
+    def uncover(self, box):
+        for r in range(DIMENSION):
+            for c in range(DIMENSION):
+                if self.squareRect(r, c).colliderect(box):
+                    self.drawn[r*DIMENSION + c] = None
+
+    """
+    Brings the screen up to date and returns the rects that changed, for pygame.display.update. text is shown
+    in the middle of the board and status, e.g. that the engine is thinking, in the bottom right corner
+    """
+    def draw(self, screen, gs, moveIndex, sqSelected, lastMove = None, text = None, status = None):
+        highlighted = set()
+        markers = {}
+        if lastMove is not None:
+            highlighted.update(((lastMove.startRow, lastMove.startCol), (lastMove.endRow, lastMove.endCol)))
+        if sqSelected != () and gs.board[sqSelected[0]][sqSelected[1]][0] == ("w" if gs.whiteToMove else "b"):
+            highlighted.add(sqSelected)
+            for move in moveIndex.movesFrom(sqSelected):
+                markers[(move.endRow, move.endCol)] = "move" if gs.board[move.endRow][move.endCol] == "--" else "capture"
+
+        #squares under the text boxes come back when the text goes away
+        if text != self.text:
+            self.uncover(self.textBox)
+        if status != self.status:
+            self.uncover(self.statusBox)
+
+        rects = []
+        for r in range(DIMENSION):
+            for c in range(DIMENSION):
+                state = (gs.board[r][c], (r, c) in highlighted, markers.get((r, c)))
+                if self.drawn[r*DIMENSION + c] != state and r*DIMENSION + c not in self.pinned:
+                    self.drawn[r*DIMENSION + c] = state
+                    rects.append(self.drawSquare(screen, r, c, *state))
+
+        if text is not None and (text != self.text or any(rect.colliderect(self.textBox) for rect in rects)):
+            self.drawText(screen, text)
+            rects.append(self.textBox)
+        if status is not None and (status != self.status or any(rect.colliderect(self.statusBox) for rect in rects)):
+            self.drawStatus(screen, status)
+            rects.append(self.statusBox)
+        self.text = text
+        self.status = status
+        return rects
 
-    box_width = 200
-    box_height = 150
-    textBox = pygame.Surface((box_width, box_height))
-    textBox.fill(pygame.Color("white"))
-    screen.blit(textBox, (WIDTH//2 - box_width//2, HEIGHT//2 - box_height//2))
 
-    screen.blit(textObject, textLocation)
+"""
+Slides the moved piece from its start to its end square. The main loop calls step once per frame, the piece's
+position follows the clock rather than the frame count and only the area the piece covers is updated
+"""
+class Animation():
+    SECONDS_PER_SQUARE = 0.05
+
+    def __init__(self, move, screen, renderer):
+        self.move = move
+        self.duration = (abs(move.endRow - move.startRow) + abs(move.endCol - move.startCol)) * self.SECONDS_PER_SQUARE
+        self.start = time.perf_counter()
+        self.previous = None
+        self.done = False
+
+        #the board as it looks during the move: the end square still shows what was there before
+        endState = (move.pieceCaptured if not move.isEnpassantMove else "--", True, None)
+        self.endRect = renderer.drawSquare(screen, move.endRow, move.endCol, *endState)
+        renderer.drawn[move.endRow*DIMENSION + move.endCol] = endState
+        renderer.pinned.add(move.endRow*DIMENSION + move.endCol)
+        self.background = screen.copy()
+
+    """
+    Draws the piece where it is now, returns the rects that changed
+    """
+    def step(self, screen):
+        move = self.move
+        progress = min((time.perf_counter() - self.start) / self.duration, 1.0) if self.duration else 1.0
+        r = move.startRow + (move.endRow - move.startRow) * progress
+        c = move.startCol + (move.endCol - move.startCol) * progress
+        rect = pygame.Rect(int(c*SQ_SIZE), int(r*SQ_SIZE), SQ_SIZE, SQ_SIZE)
+        rects = [rect, self.endRect] if self.previous is None else [self.previous, rect]
+        if self.previous is not None:
+            screen.blit(self.background, self.previous, self.previous)
+        screen.blit(IMAGES[move.pieceMoved], rect)
+        self.previous = rect
+        self.done = progress >= 1.0
+        return rects
+
+    """
+    Takes the piece off the screen again and lets the renderer redraw the end square properly
+    """
+    def finish(self, screen, renderer):
+        renderer.pinned.discard(self.move.endRow*DIMENSION + self.move.endCol)
+        renderer.drawn[self.move.endRow*DIMENSION + self.move.endCol] = None
+        if self.previous is None:
+            return []
+        screen.blit(self.background, self.previous, self.previous)
+        return [self.previous]
 
 
 if __name__ == "__main__":
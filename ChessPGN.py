@@ -0,0 +1,339 @@
+"""
+PGN import and export.
+
+readGames streams games out of a PGN file one at a time without loading the file, optionally
+only collecting the headers or only the movetext of games whose headers pass a filter. Moves are
+not parsed until a game is replayed, SAN is resolved against GameState.getValidMoves.
+
+    for game in ChessPGN.readGames("archive.pgn", headerFilter = lambda h: h.get("Result") == "1-0"):
+        for san, move in game.replay():
+            ...
+
+gameToPGN/writeGame turn a GameState's moveLog back into PGN with SAN moves.
+"""
+import mmap
+import re
+
+import ChessEngine
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+SEVEN_TAG_ROSTER = ["Event", "Site", "Date", "Round", "White", "Black", "Result"]
+
+_HEADER = re.compile(rb'^\s*\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+_MOVE_NUMBER = re.compile(r"^\d+\.+")
+_SAN = re.compile(r"^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$")
+
+
+class PGNGame():
+    def __init__(self, headers, movetext, offset = 0):
+        self.headers = headers
+        self.movetext = movetext
+        #byte offset of the game in the file it was read from
+        self.offset = offset
+
+    def __repr__(self):
+        return "PGNGame(%s vs %s, %s)" % (self.headers.get("White", "?"), self.headers.get("Black", "?"),
+                                          self.headers.get("Result", "*"))
+
+    """
+    Yields the SAN of every mainline move, comments, variations, NAGs and move numbers are skipped
+    """
+    def sanMoves(self):
+        return tokenize(self.movetext or "")
+
+    """
+    Plays the game on a new GameState (or gs), yielding (san, move) after each move is made
+    """
+    def replay(self, gs = None):
+        if gs is None:
+            gs = self.startPosition()
+        for san in self.sanMoves():
+            move = sanToMove(gs, san)
+            gs.makeMove(move)
+            yield san, move
+
+    def startPosition(self):
+        if "FEN" in self.headers:
+            return ChessEngine.GameState.fromFEN(self.headers["FEN"])
+        return ChessEngine.GameState()
+
+    """
+    Returns the GameState after the last move of the game
+    """
+    def gameState(self):
+        gs = self.startPosition()
+        for san, move in self.replay(gs):
+            pass
+        return gs
+
+
+"""
+Splits movetext into SAN tokens
+"""
+def tokenize(movetext):
+    i = 0
+    n = len(movetext)
+    depth = 0
+    while i < n:
+        char = movetext[i]
+        if char == "{":
+            end = movetext.find("}", i)
+            i = n if end < 0 else end + 1
+        elif char == ";":
+            end = movetext.find("\n", i)
+            i = n if end < 0 else end + 1
+        elif char == "(":
+            depth += 1
+            i += 1
+        elif char == ")":
+            depth -= 1
+            i += 1
+        elif char.isspace():
+            i += 1
+        else:
+            start = i
+            while i < n and not movetext[i].isspace() and movetext[i] not in "{;()":
+                i += 1
+            token = movetext[start:i]
+            if depth > 0 or token[0] == "$" or token in RESULTS:
+                continue
+            #strip move numbers, "12." or "12..." possibly glued to the move
+            token = _MOVE_NUMBER.sub("", token)
+            if token:
+                yield token
+
+
+def _lines(source):
+    if isinstance(source, (str, bytes)):
+        with open(source, "rb") as f:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+            except ValueError:
+                #empty files can't be mapped
+                return
+            with mapped:
+                yield from iter(mapped.readline, b"")
+    else:
+        for line in source:
+            yield line.encode("utf-8") if isinstance(line, str) else line
+
+
+"""
+Yields a PGNGame for every game in source, a path (memory mapped) or an open text or binary file.
+Only games whose headers pass headerFilter keep their movetext, with headersOnly no movetext is kept at all
+"""
+def readGames(source, headerFilter = None, headersOnly = False):
+    headers = {}
+    movetext = []
+    inMoves = False
+    keep = True
+    offset = 0
+    gameOffset = 0
+
+    for line in _lines(source):
+        lineOffset = offset
+        offset += len(line)
+        stripped = line.strip()
+
+        if stripped.startswith(b"["):
+            if inMoves:
+                yield PGNGame(headers, None if headersOnly or not keep else b" ".join(movetext).decode("utf-8", "replace"), gameOffset)
+                headers = {}
+                movetext = []
+                inMoves = False
+            if not headers:
+                gameOffset = lineOffset
+            match = _HEADER.match(line)
+            if match:
+                headers[match.group(1).decode("ascii")] = match.group(2).decode("utf-8", "replace").replace('\\"', '"').replace("\\\\", "\\")
+        elif stripped:
+            if not inMoves:
+                inMoves = True
+                if not headers:
+                    gameOffset = lineOffset
+                keep = headerFilter is None or headerFilter(headers)
+            if keep and not headersOnly:
+                movetext.append(stripped)
+
+    if inMoves or headers:
+        yield PGNGame(headers, None if headersOnly or not keep else b" ".join(movetext).decode("utf-8", "replace"), gameOffset)
+
+
+"""
+Reads the single game starting at a byte offset found by an earlier readGames or scanHeaders pass
+"""
+def readGameAt(path, offset):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        game = next(readGames(f), None)
+    if game is not None:
+        game.offset = offset
+    return game
+
+
+"""
+Yields only the headers of every game, without keeping any movetext
+"""
+def scanHeaders(source):
+    for game in readGames(source, headersOnly = True):
+        yield game.headers
+
+
+"""
+Finds the legal move in gs written as san. validMoves may be a list of moves or a ChessEngine.MoveIndex,
+by default the index of gs is used
+"""
+def sanToMove(gs, san, validMoves = None):
+    index = _moveIndex(gs, validMoves)
+    san = san.rstrip("+#!?")
+
+    if san in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        kingside = len(san) == 3
+        for move in index.movesFrom(gs.whiteKingLocation if gs.whiteToMove else gs.blackKingLocation):
+            if move.isCastleMove and (move.endCol > move.startCol) == kingside:
+                return move
+        raise ValueError("illegal move " + san)
+
+    match = _SAN.match(san)
+    if not match:
+        raise ValueError("unreadable move " + san)
+    piece, fromFile, fromRank, target, promotion = match.groups()
+    piece = piece or "P"
+    endRow = ChessEngine.Move.ranksToRows[target[1]]
+    endCol = ChessEngine.Move.filesToCols[target[0]]
+
+    candidates = []
+    for move in index.movesTo((endRow, endCol)):
+        if (move.pieceMoved[1] == piece and
+                (fromFile is None or move.startCol == ChessEngine.Move.filesToCols[fromFile]) and
+                (fromRank is None or move.startRow == ChessEngine.Move.ranksToRows[fromRank]) and
+                (not move.isPawnPromotion or move.promotionChoice == (promotion or "Q"))):
+            candidates.append(move)
+
+    if len(candidates) != 1:
+        raise ValueError(("ambiguous move " if candidates else "illegal move ") + san)
+    return candidates[0]
+
+
+def _moveIndex(gs, validMoves):
+    if validMoves is None:
+        return gs.getMoveIndex()
+    if isinstance(validMoves, ChessEngine.MoveIndex):
+        return validMoves
+    return ChessEngine.MoveIndex(validMoves)
+
+
+"""
+Writes move, which must be legal in gs, in SAN. The check and mate suffix is only added with checkSuffix,
+since finding it means making the move
+"""
+def moveToSAN(gs, move, validMoves = None, checkSuffix = True):
+    index = _moveIndex(gs, validMoves)
+
+    if move.isCastleMove:
+        san = "O-O" if move.endCol > move.startCol else "O-O-O"
+    else:
+        piece = move.pieceMoved[1]
+        target = move.getRankFile(move.endRow, move.endCol)
+        capture = move.pieceCaptured != "--"
+
+        if piece == "P":
+            san = (move.colsToFiles[move.startCol] + "x" if capture else "") + target
+            if move.isPawnPromotion:
+                san += "=" + move.promotionChoice
+        else:
+            #disambiguate by file, then rank, then both
+            others = [other for other in index.movesTo((move.endRow, move.endCol)) if other.pieceMoved == move.pieceMoved and
+                      (other.startRow, other.startCol) != (move.startRow, move.startCol)]
+            disambiguation = ""
+            if others:
+                if all(other.startCol != move.startCol for other in others):
+                    disambiguation = move.colsToFiles[move.startCol]
+                elif all(other.startRow != move.startRow for other in others):
+                    disambiguation = move.rowsToRanks[move.startRow]
+                else:
+                    disambiguation = move.getRankFile(move.startRow, move.startCol)
+            san = piece + disambiguation + ("x" if capture else "") + target
+
+    if checkSuffix:
+        checkMate, staleMate = gs.checkMate, gs.staleMate
+        gs.makeMove(move)
+        if gs.inCheck():
+            san += "#" if not gs.getValidMoves() else "+"
+        gs.undoMove()
+        gs.checkMate, gs.staleMate = checkMate, staleMate
+    return san
+
+
+"""
+Returns the result tag for the current state of gs
+"""
+def gameResult(gs):
+    if gs.checkMate:
+        return "0-1" if gs.whiteToMove else "1-0"
+    if gs.staleMate:
+        return "1/2-1/2"
+    return "*"
+
+
+"""
+Returns the game in gs.moveLog as PGN text. gs is unwound to the start and replayed to produce SAN,
+and is left as it was
+"""
+def gameToPGN(gs, headers = None):
+    checkMate, staleMate = gs.checkMate, gs.staleMate
+    played = list(gs.moveLog)
+    for move in played:
+        gs.undoMove()
+
+    startFEN = gs.toFEN()
+    sans = []
+    startWhite = gs.whiteToMove
+    startNumber = gs.getFullmoveNumber()
+    for move in played:
+        sans.append(moveToSAN(gs, move))
+        gs.makeMove(move)
+    gs.getValidMoves()
+    result = gameResult(gs)
+    gs.checkMate, gs.staleMate = checkMate, staleMate
+
+    tags = {tag: "?" for tag in SEVEN_TAG_ROSTER}
+    tags["Result"] = result
+    if startFEN != ChessEngine.INITIAL_FEN:
+        tags["SetUp"] = "1"
+        tags["FEN"] = startFEN
+    tags.update(headers or {})
+
+    lines = ['[%s "%s"]' % (tag, str(value).replace("\\", "\\\\").replace('"', '\\"')) for tag, value in tags.items()]
+    lines.append("")
+
+    #number the moves from the start position's move number, a game starting with black to move opens with "n..."
+    tokens = []
+    number = startNumber
+    white = startWhite
+    for i, san in enumerate(sans):
+        if white:
+            tokens.append("%d. %s" % (number, san))
+        elif i == 0:
+            tokens.append("%d... %s" % (number, san))
+        else:
+            tokens.append(san)
+        if not white:
+            number += 1
+        white = not white
+    tokens.append(tags["Result"])
+
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > 79:
+            lines.append(line)
+            line = token
+        else:
+            line = line + " " + token if line else token
+    lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def writeGame(out, gs, headers = None):
+    out.write(gameToPGN(gs, headers))
+    out.write("\n")
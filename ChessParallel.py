@@ -0,0 +1,135 @@
+"""
+Lazy-SMP parallel search: several processes search the same position at the same time and share one
+transposition table in shared memory, so each helper's results speed up the others. The main worker's
+result is returned unless a helper finished a deeper iteration.
+
+    with ChessParallel.ParallelSearcher(workers = 8) as searcher:
+        result = searcher.search(gs, ChessSearch.SearchLimits(movetime = 2.0))
+"""
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+
+import ChessEngine
+import ChessSearch
+from ChessTranspositionTable import TranspositionTable, tableSize
+
+#state of a worker process, set up once by _initWorker
+_worker = {}
+
+#helper i skips the iterations where (depth + SKIP_PHASE[i]) // SKIP_SIZE[i] is odd, so the helpers spread over
+#different depths whatever the limit instead of all repeating the main worker's iterations
+SKIP_SIZE = (1, 1, 2, 2, 2, 2, 3, 3, 3, 3, 3, 3, 4, 4, 4, 4, 4, 4, 4, 4)
+SKIP_PHASE = (0, 1, 0, 1, 2, 3, 0, 1, 2, 3, 4, 5, 0, 1, 2, 3, 4, 5, 6, 7)
+
+
+"""
+Searcher of a helper worker, skipping iterations by its index. The first and last depths are always searched so
+a helper always has a move and finishes the depth it was given
+"""
+class HelperSearcher(ChessSearch.Searcher):
+    def __init__(self, gs, limits, tt, stopEvent, helper):
+        super().__init__(gs, limits, tt, stopEvent = stopEvent)
+        self.helper = helper
+
+    def depths(self):
+        size = SKIP_SIZE[(self.helper - 1) % len(SKIP_SIZE)]
+        phase = SKIP_PHASE[(self.helper - 1) % len(SKIP_PHASE)]
+        maxDepth = self.limits.maxDepth()
+        for depth in range(1, maxDepth + 1):
+            if depth == 1 or depth == maxDepth or (depth + phase) // size % 2 == 0:
+                yield depth
+
+
+def _initWorker(shmName, ttMB, policy, stopEvent):
+    shm = shared_memory.SharedMemory(name = shmName)
+    _worker["shm"] = shm
+    _worker["tt"] = TranspositionTable(ttMB, policy, buffer = shm.buf)
+    _worker["stop"] = stopEvent
+
+
+def _searchWorker(snapshot, history, limits, helper, generation):
+    gs = ChessEngine.GameState.fromSnapshot(snapshot, history)
+    tt = _worker["tt"]
+    #Searcher.search starts a new generation itself, start one behind so entries carry the parent's generation
+    tt.generation = (generation - 1) & 0xff
+    tt.resetStats()
+
+    #odd helpers search one ply deeper than the main worker so the workers do not all finish the same iterations together
+    if helper % 2 == 1 and limits.depth is not None:
+        limits = ChessSearch.SearchLimits(limits.depth + 1, limits.movetime, limits.nodes)
+
+    if helper == 0:
+        searcher = ChessSearch.Searcher(gs, limits, tt, stopEvent = _worker["stop"])
+    else:
+        searcher = HelperSearcher(gs, limits, tt, _worker["stop"], helper)
+    result = searcher.search()
+    return helper, result, tt.hits, tt.probes
+
+
+class ParallelSearcher():
+    def __init__(self, workers = None, ttMB = ChessSearch.DEFAULT_TT_MB, policy = "depth"):
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        self.shm = shared_memory.SharedMemory(create = True, size = tableSize(ttMB))
+        self.tt = TranspositionTable(ttMB, policy, buffer = self.shm.buf)
+
+        context = multiprocessing.get_context()
+        self.stopEvent = context.Event()
+        self.pool = context.Pool(self.workers, initializer = _initWorker,
+                                 initargs = (self.shm.name, ttMB, policy, self.stopEvent))
+        self.hits = 0
+        self.probes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    """
+    Searches gs on all workers and returns a SearchResult like ChessSearch.bestMove, with the nodes of all workers
+    """
+    def search(self, gs, limits = None):
+        limits = limits if limits is not None else ChessSearch.SearchLimits()
+        self.tt.newSearch()
+        self.stopEvent.clear()
+
+        #workers get a snapshot of the position rather than the whole GameState, with just the hashes since
+        #the last capture or pawn move so they still see repetitions
+        snapshot = gs.snapshot()
+        history = gs.repetitionHistory()
+        pending = [self.pool.apply_async(_searchWorker, (snapshot, history, limits, helper, self.tt.generation))
+                   for helper in range(self.workers)]
+
+        #the main worker decides when the search is over, the helpers are stopped as soon as it returns
+        results = [pending[0].get()]
+        self.stopEvent.set()
+        results += [task.get() for task in pending[1:]]
+
+        best = results[0][1]
+        for helper, result, hits, probes in results[1:]:
+            if result.move is not None and result.depth > best.depth:
+                best = result
+
+        self.hits = sum(hits for helper, result, hits, probes in results)
+        self.probes = sum(probes for helper, result, hits, probes in results)
+        return ChessSearch.SearchResult(best.move, best.score, best.depth, sum(result.nodes for helper, result, hits, probes in results),
+                                        results[0][1].elapsed, best.pv)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+            self.tt.release()
+            self.tt = None
+            self.shm.close()
+            self.shm.unlink()
+
+
+"""
+One-off parallel search, a ParallelSearcher is cheaper when searching many positions
+"""
+def bestMoveParallel(gs, limits = None, workers = None, ttMB = ChessSearch.DEFAULT_TT_MB):
+    with ParallelSearcher(workers, ttMB) as searcher:
+        return searcher.search(gs, limits)
@@ -0,0 +1,116 @@
+"""
+Perft node counting for the move generator: counts the leaf nodes of the full legal move tree to a fixed depth
+and compares them against the published counts of standard test positions.
+
+Usage:
+    python ChessPerft.py                         run the bundled suite
+    python ChessPerft.py --depth 5               run the suite up to depth 5
+    python ChessPerft.py --fen "<fen>" --depth 3 --divide
+"""
+import argparse
+import sys
+import time
+
+import ChessEngine
+
+#(name, fen, node counts for depth 1, 2, ...)
+POSITIONS = [
+    ("initial", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+     [20, 400, 8902, 197281, 4865609]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862, 4085603]),
+    ("rook endgame", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     [14, 191, 2812, 43238, 674624]),
+    ("promotions", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467, 422333]),
+    ("discovered check", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     [44, 1486, 62379, 2103487]),
+    ("middlegame", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     [46, 2079, 89890, 3894594]),
+]
+
+DEFAULT_DEPTH = 3
+
+
+"""
+Counts the leaf nodes of the legal move tree below gs to the given depth. The move generator is called
+directly so the counts test it rather than the move cache
+"""
+def perft(gs, depth):
+    moves = gs.generateValidMoves()
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1
+
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1)
+        gs.undoMove()
+    return nodes
+
+
+"""
+Returns the perft count below each root move, keyed by the move's notation
+"""
+def divide(gs, depth):
+    counts = {}
+    for move in gs.generateValidMoves():
+        gs.makeMove(move)
+        counts[move.getChessNotation()] = perft(gs, depth - 1)
+        gs.undoMove()
+    return counts
+
+
+"""
+Runs perft on every bundled position up to maxDepth, returns True if all counts matched
+"""
+def runSuite(maxDepth, out = sys.stdout):
+    allPassed = True
+    totalNodes = 0
+    totalTime = 0.0
+
+    for name, fen, expected in POSITIONS:
+        for depth in range(1, min(maxDepth, len(expected)) + 1):
+            gs = ChessEngine.GameState.fromFEN(fen)
+            start = time.perf_counter()
+            nodes = perft(gs, depth)
+            elapsed = time.perf_counter() - start
+            totalNodes += nodes
+            totalTime += elapsed
+
+            passed = nodes == expected[depth - 1]
+            allPassed = allPassed and passed
+            out.write("%-18s depth %d  %10d nodes  %8.2fs  %9.0f nps  %s\n" % (
+                name, depth, nodes, elapsed, nodes / elapsed if elapsed else 0,
+                "ok" if passed else "FAIL (expected %d)" % expected[depth - 1]))
+
+    out.write("total %d nodes in %.2fs, %.0f nps\n" % (totalNodes, totalTime, totalNodes / totalTime if totalTime else 0))
+    return allPassed
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Perft move generation benchmark and correctness check")
+    parser.add_argument("--fen", help = "position to count instead of running the bundled suite")
+    parser.add_argument("--depth", type = int, default = DEFAULT_DEPTH)
+    parser.add_argument("--divide", action = "store_true", help = "print the node count below each root move")
+    args = parser.parse_args(argv)
+
+    if args.fen is None:
+        return 0 if runSuite(args.depth) else 1
+
+    gs = ChessEngine.GameState.fromFEN(args.fen)
+    start = time.perf_counter()
+    if args.divide:
+        counts = divide(gs, args.depth)
+        for notation in sorted(counts):
+            print("%s: %d" % (notation, counts[notation]))
+        nodes = sum(counts.values())
+    else:
+        nodes = perft(gs, args.depth)
+    elapsed = time.perf_counter() - start
+    print("nodes %d  time %.2fs  nps %.0f" % (nodes, elapsed, nodes / elapsed if elapsed else 0))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
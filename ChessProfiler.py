@@ -0,0 +1,313 @@
+"""
+Opt-in instrumentation of the engine's hot paths: calls, time and Move allocations per move generator and
+attack helper, move cache and transposition table hit rates, and search nodes per second.
+
+    profiler = ChessProfiler.Profiler()
+    with profiler:
+        ChessSearch.bestMove(gs, ChessSearch.SearchLimits(depth = 4))
+    profiler.printReport()
+    profiler.writeJSON("profile.json")
+    profiler.dumpStats("profile.prof")       # or pstats.Stats(profiler)
+
+While no profiler is running the engine's own functions are in place and cost nothing extra: entering a
+profiler swaps timing wrappers into the classes and leaving it puts the originals back. Only one profiler runs
+at a time, and the wrappers keep a single call stack, so profile one thread at a time.
+
+    python ChessProfiler.py --depth 4
+    python ChessProfiler.py --perft 3 --json profile.json --pstats profile.prof
+"""
+import argparse
+import json
+import marshal
+import sys
+import time
+
+import ChessEngine
+import ChessPerft
+import ChessSearch
+from ChessTranspositionTable import TranspositionTable
+
+#(class, methods) timed while profiling
+TARGETS = [
+    (ChessEngine.GameState, ("getValidMoves", "getMoveIndex", "generateValidMoves", "getAllPossibleMoves",
+                             "getPawnMoves", "getRookMoves", "getKnightMoves", "getBishopMoves", "getQueenMoves",
+                             "getKingMoves", "getCastleMoves", "addMoves", "attackersTo", "attackedSquares",
+                             "squareUnderAttack", "inCheck", "enpassantExposesKing", "makeMove", "undoMove",
+                             "evaluate")),
+    (ChessSearch.Searcher, ("search", "orderMoves", "quiesce")),
+]
+
+#the profiler currently swapped in, if any
+_active = None
+
+
+class FunctionStats():
+    __slots__ = ("name", "code", "calls", "primitiveCalls", "ownTime", "totalTime", "allocations", "callers")
+
+    def __init__(self, name, function):
+        self.name = name
+        code = function.__code__
+        #cProfile's key for a function
+        self.code = (code.co_filename, code.co_firstlineno, code.co_name)
+        self.clear()
+
+    def clear(self):
+        self.calls = 0
+        self.primitiveCalls = 0
+        self.ownTime = 0
+        self.totalTime = 0
+        self.allocations = 0
+        #caller FunctionStats (None at the top) to [calls, primitiveCalls, ownTime, totalTime]
+        self.callers = {}
+
+    def report(self):
+        calls = self.calls or 1
+        return {
+            "calls": self.calls,
+            "time": self.totalTime / 1e9,
+            "ownTime": self.ownTime / 1e9,
+            "usPerCall": self.totalTime / 1e3 / calls,
+            "moveAllocations": self.allocations,
+            "movesPerCall": self.allocations / calls
+        }
+
+
+class Profiler():
+    def __init__(self):
+        self.functions = {}
+        self.saved = []
+        self.reset()
+
+    """
+    Clears everything collected so far
+    """
+    def reset(self):
+        for stats in self.functions.values():
+            stats.clear()
+        self.allocations = [0]
+        self.cacheProbes = [0, 0]
+        self.ttProbes = [0, 0]
+        self.searches = [0, 0, 0.0]
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.disable()
+
+    """
+    Swaps the counting wrappers into the engine's classes
+    """
+    def enable(self):
+        global _active
+        if _active is not None:
+            raise RuntimeError("a profiler is already running")
+        _active = self
+        self.started = time.perf_counter()
+        stack = []
+
+        for cls, names in TARGETS:
+            for name in names:
+                original = cls.__dict__[name]
+                key = cls.__name__ + "." + name
+                if key not in self.functions:
+                    self.functions[key] = FunctionStats(key, original)
+                self.patch(cls, name, self.timed(original, self.functions[key], stack))
+
+        #the piece generators are also called through the moveFunctions table
+        table = ChessEngine.GameState.moveFunctions
+        for piece, function in list(table.items()):
+            self.patch(table, piece, ChessEngine.GameState.__dict__[function.__name__])
+
+        allocations = self.allocations
+        init = ChessEngine.Move.__init__
+        def countingInit(move, *args, **kwargs):
+            allocations[0] += 1
+            init(move, *args, **kwargs)
+        self.patch(ChessEngine.Move, "__init__", countingInit)
+
+        self.patch(ChessEngine.MoveCache, "get", self.counted(ChessEngine.MoveCache.get, self.cacheProbes))
+        self.patch(TranspositionTable, "probe", self.counted(TranspositionTable.probe, self.ttProbes))
+
+        searches = self.searches
+        def searchTotals(function):
+            def wrapper(searcher):
+                result = function(searcher)
+                searches[0] += 1
+                searches[1] += result.nodes
+                searches[2] += result.elapsed
+                return result
+            return wrapper
+        self.patch(ChessSearch.Searcher, "search", searchTotals(ChessSearch.Searcher.search))
+
+    """
+    Puts the engine's own functions back
+    """
+    def disable(self):
+        global _active
+        if _active is not self:
+            return
+        while self.saved:
+            target, name, original = self.saved.pop()
+            if isinstance(target, dict):
+                target[name] = original
+            else:
+                setattr(target, name, original)
+        self.elapsed += time.perf_counter() - self.started
+        _active = None
+
+    def patch(self, target, name, replacement):
+        if isinstance(target, dict):
+            self.saved.append((target, name, target[name]))
+            target[name] = replacement
+        else:
+            self.saved.append((target, name, target.__dict__[name]))
+            setattr(target, name, replacement)
+
+    """
+    Wraps function to count its calls, inclusive and own time and the Moves made under it. stack holds
+    [stats, time spent in timed callees] for every timed call in progress
+    """
+    def timed(self, function, stats, stack):
+        allocations = self.allocations
+        clock = time.perf_counter_ns
+
+        def wrapper(*args, **kwargs):
+            caller = stack[-1][0] if stack else None
+            recursive = any(frame[0] is stats for frame in stack)
+            frame = [stats, 0]
+            stack.append(frame)
+            made = allocations[0]
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = clock() - start
+                stack.pop()
+                own = elapsed - frame[1]
+                if stack:
+                    stack[-1][1] += elapsed
+                stats.calls += 1
+                stats.ownTime += own
+                stats.allocations += allocations[0] - made
+                if not recursive:
+                    stats.primitiveCalls += 1
+                    stats.totalTime += elapsed
+                edge = stats.callers.get(caller)
+                if edge is None:
+                    edge = stats.callers[caller] = [0, 0, 0, 0]
+                edge[0] += 1
+                edge[2] += own
+                if not recursive:
+                    edge[1] += 1
+                    edge[3] += elapsed
+
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        return wrapper
+
+    """
+    Wraps a probe function to count [probes, hits] in counts, a hit being anything but None
+    """
+    def counted(self, function, counts):
+        def wrapper(*args):
+            entry = function(*args)
+            counts[0] += 1
+            if entry is not None:
+                counts[1] += 1
+            return entry
+        return wrapper
+
+    """
+    Returns everything collected as a dict that json can write
+    """
+    def report(self):
+        elapsed = self.elapsed + (time.perf_counter() - self.started if _active is self else 0.0)
+        searches, nodes, searchTime = self.searches
+        return {
+            "elapsed": elapsed,
+            "functions": {name: stats.report() for name, stats in self.functions.items() if stats.calls},
+            "moveAllocations": self.allocations[0],
+            "moveCache": _hitRates(self.cacheProbes),
+            "transpositionTable": _hitRates(self.ttProbes),
+            "search": {"searches": searches, "nodes": nodes, "time": searchTime,
+                       "nps": nodes / searchTime if searchTime else 0.0}
+        }
+
+    def writeJSON(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent = 2)
+
+    """
+    Fills self.stats in the layout cProfile uses, so pstats.Stats(profiler) reads it. Times are in seconds
+    """
+    def create_stats(self):
+        self.stats = {}
+        for stats in self.functions.values():
+            if not stats.calls:
+                continue
+            callers = {}
+            for caller, (calls, primitiveCalls, ownTime, totalTime) in stats.callers.items():
+                key = caller.code if caller is not None else ("~", 0, "<profiler>")
+                callers[key] = (primitiveCalls, calls, ownTime / 1e9, totalTime / 1e9)
+            self.stats[stats.code] = (stats.primitiveCalls, stats.calls, stats.ownTime / 1e9, stats.totalTime / 1e9, callers)
+
+    """
+    Writes the timings in the file format of cProfile.Profile.dump_stats, for pstats, snakeviz and the like
+    """
+    def dumpStats(self, path):
+        self.create_stats()
+        with open(path, "wb") as f:
+            marshal.dump(self.stats, f)
+
+    def printReport(self, out = sys.stdout, limit = None):
+        report = self.report()
+        functions = sorted(report["functions"].items(), key = lambda item: -item[1]["ownTime"])
+        out.write("%-32s %10s %10s %10s %10s %10s\n" % ("function", "calls", "time", "own", "us/call", "moves/call"))
+        for name, stats in functions[:limit]:
+            out.write("%-32s %10d %10.3f %10.3f %10.2f %10.2f\n" % (
+                name, stats["calls"], stats["time"], stats["ownTime"], stats["usPerCall"], stats["movesPerCall"]))
+        out.write("move allocations %d\n" % report["moveAllocations"])
+        for name in ("moveCache", "transpositionTable"):
+            out.write("%s %d probes, %.1f%% hits\n" % (name, report[name]["probes"], 100 * report[name]["hitRate"]))
+        search = report["search"]
+        if search["searches"]:
+            out.write("search %d nodes in %.2fs, %.0f nps\n" % (search["nodes"], search["time"], search["nps"]))
+
+
+def _hitRates(counts):
+    probes, hits = counts
+    return {"probes": probes, "hits": hits, "hitRate": hits / probes if probes else 0.0}
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Profile the move generator and search")
+    parser.add_argument("--fen", default = ChessEngine.INITIAL_FEN)
+    parser.add_argument("--depth", type = int, default = 4, help = "search depth")
+    parser.add_argument("--perft", type = int, help = "profile a perft count of this depth instead of a search")
+    parser.add_argument("--json", help = "write the report to this file")
+    parser.add_argument("--pstats", help = "write cProfile compatible stats to this file")
+    parser.add_argument("--limit", type = int, default = 25, help = "functions to print")
+    args = parser.parse_args(argv)
+
+    gs = ChessEngine.GameState.fromFEN(args.fen)
+    profiler = Profiler()
+    with profiler:
+        if args.perft is not None:
+            print("perft %d: %d nodes" % (args.perft, ChessPerft.perft(gs, args.perft)))
+        else:
+            result = ChessSearch.bestMove(gs, ChessSearch.SearchLimits(depth = args.depth))
+            print("best move %s score %d depth %d" % (result.move.getChessNotation() if result.move else "-",
+                                                      result.score, result.depth))
+    profiler.printReport(limit = args.limit)
+    if args.json:
+        profiler.writeJSON(args.json)
+    if args.pstats:
+        profiler.dumpStats(args.pstats)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,325 @@
+"""
+Engine search on top of GameState: negamax alpha-beta with iterative deepening, quiescence search,
+MVV-LVA/killer/history move ordering and a depth, time or node budget.
+
+    result = ChessSearch.bestMove(gs, ChessSearch.SearchLimits(movetime = 1.0))
+    gs.makeMove(result.move)
+"""
+import time
+
+import ChessEngine
+from ChessBitboard import popCount
+from ChessTablebase import MAX_DTM
+from ChessTranspositionTable import TranspositionTable, EXACT, LOWER, UPPER
+
+MATE = 100000
+MAX_PLY = 64
+INFINITY = MATE + 1
+#scores at least this far from zero are mates, found by the search within MAX_PLY plies or read from a
+#tablebase up to MAX_DTM plies beyond that
+MATE_BOUND = MATE - MAX_PLY - MAX_DTM
+
+PIECE_VALUES = {"P": 100, "N": 320, "B": 330, "R": 500, "Q": 900, "K": 0}
+
+#how often (in nodes) the clock and the stop flag are looked at
+CHECK_INTERVAL = 1024
+
+#size of the table shared by searches that are not given one
+DEFAULT_TT_MB = 16
+_defaultTable = None
+
+
+class SearchAborted(Exception):
+    pass
+
+
+"""
+Budget for a search, any combination can be given and the first one reached ends the search.
+Without any limit the search runs to DEFAULT_DEPTH
+"""
+class SearchLimits():
+    DEFAULT_DEPTH = 4
+
+    def __init__(self, depth = None, movetime = None, nodes = None):
+        self.depth = depth
+        self.movetime = movetime
+        self.nodes = nodes
+
+    def maxDepth(self):
+        if self.depth is not None:
+            return min(self.depth, MAX_PLY - 1)
+        if self.movetime is None and self.nodes is None:
+            return self.DEFAULT_DEPTH
+        return MAX_PLY - 1
+
+
+class SearchResult():
+    def __init__(self, move, score, depth, nodes, elapsed, pv):
+        self.move = move
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        self.elapsed = elapsed
+        self.pv = pv
+
+    def __repr__(self):
+        return "SearchResult(move=%s, score=%d, depth=%d, nodes=%d)" % (self.move, self.score, self.depth, self.nodes)
+
+
+"""
+Static evaluation from the side to move's point of view, see ChessEvaluation
+"""
+def evaluate(gs):
+    return gs.evaluate()
+
+
+"""
+Returns the transposition table used by searches that are not given one, created on first use
+"""
+def defaultTable():
+    global _defaultTable
+    if _defaultTable is None:
+        _defaultTable = TranspositionTable(DEFAULT_TT_MB)
+    return _defaultTable
+
+
+"""
+Mate scores are stored relative to the node rather than the root, so they stay correct when
+the same position is reached at a different ply
+"""
+def scoreToTT(score, ply):
+    if score >= MATE_BOUND:
+        return score + ply
+    if score <= -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def scoreFromTT(score, ply):
+    if score >= MATE_BOUND:
+        return score - ply
+    if score <= -MATE_BOUND:
+        return score + ply
+    return score
+
+
+"""
+Returns if the move captures a piece or promotes a pawn
+"""
+def isTactical(move):
+    return move.pieceCaptured != "--" or move.isPawnPromotion
+
+
+class Searcher():
+    def __init__(self, gs, limits = None, tt = None, stopEvent = None, tablebase = None):
+        self.gs = gs
+        self.stopEvent = stopEvent
+        #a ChessTablebase.Tablebase, positions it knows are scored from it instead of being searched
+        self.tablebase = tablebase
+        self.limits = limits if limits is not None else SearchLimits()
+        self.tt = tt if tt is not None else defaultTable()
+        self.nodes = 0
+        self.startTime = 0.0
+        self.stopped = False
+        self.killers = [[None, None] for ply in range(MAX_PLY + 1)]
+        self.history = {}
+        self.pv = [[] for ply in range(MAX_PLY + 1)]
+        self.rootPV = []
+
+    """
+    Asks a running search to stop, it returns the result of the last completed iteration.
+    Setting stopEvent (anything with is_set, e.g. a threading or multiprocessing Event) does the same from elsewhere
+    """
+    def stop(self):
+        self.stopped = True
+
+    def checkLimits(self):
+        if self.stopped or (self.stopEvent is not None and self.stopEvent.is_set()):
+            raise SearchAborted()
+        if self.limits.nodes is not None and self.nodes >= self.limits.nodes:
+            raise SearchAborted()
+        if self.limits.movetime is not None and time.perf_counter() - self.startTime >= self.limits.movetime:
+            raise SearchAborted()
+
+    """
+    Runs iterative deepening until the depth is reached or the budget runs out
+    """
+    def search(self):
+        gs = self.gs
+        checkMate, staleMate = gs.checkMate, gs.staleMate
+        self.startTime = time.perf_counter()
+        self.tt.newSearch()
+        rootMoves = gs.getValidMoves()
+        result = SearchResult(rootMoves[0] if rootMoves else None, 0, 0, 0, 0.0, [])
+
+        if rootMoves:
+            for depth in self.depths():
+                try:
+                    score = self.negamax(depth, -INFINITY, INFINITY, 0)
+                except SearchAborted:
+                    break
+                self.rootPV = list(self.pv[0])
+                result = SearchResult(self.rootPV[0], score, depth, self.nodes, time.perf_counter() - self.startTime, self.rootPV)
+
+                #no point searching deeper once a forced mate is found
+                if abs(score) >= MATE_BOUND:
+                    break
+
+        result.nodes = self.nodes
+        result.elapsed = time.perf_counter() - self.startTime
+        gs.checkMate, gs.staleMate = checkMate, staleMate
+        return result
+
+    """
+    The depths iterative deepening searches, in order
+    """
+    def depths(self):
+        return range(1, self.limits.maxDepth() + 1)
+
+    def negamax(self, depth, alpha, beta, ply):
+        gs = self.gs
+        self.nodes += 1
+        if self.nodes % CHECK_INTERVAL == 0:
+            self.checkLimits()
+        self.pv[ply] = []
+
+        #draws by rule, inside the tree a position occurring a second time is already treated as a repetition
+        if ply > 0 and (gs.halfmoveLog[-1] >= 100 or (gs.halfmoveLog[-1] >= 4 and gs.repetitionCount() >= 2) or
+                        gs.isInsufficientMaterial()):
+            return 0
+
+        #transposition table cutoff, never at the root so the root always has a move and a PV
+        entry = self.tt.probe(gs.hash)
+        ttMove = None
+        if entry is not None:
+            if entry.move:
+                ttMove = ChessEngine.Move.fromEncoded(entry.move, gs.board)
+            if ply > 0 and entry.depth >= depth:
+                score = scoreFromTT(entry.score, ply)
+                if (entry.bound == EXACT or (entry.bound == LOWER and score >= beta) or
+                        (entry.bound == UPPER and score <= alpha)):
+                    return score
+
+        if ply > 0 and self.tablebase is not None and popCount(gs.colorBitboards["w"] | gs.colorBitboards["b"]) <= self.tablebase.maxPieces:
+            result = self.tablebase.probe(gs)
+            if result is not None:
+                wdl, dtm = result
+                return 0 if wdl == 0 else wdl * (MATE - ply - dtm)
+
+        moves = gs.getValidMoves()
+        if not moves:
+            return -MATE + ply if gs.checkMate else 0
+        if depth <= 0 or ply >= MAX_PLY:
+            return self.quiesce(alpha, beta, ply, moves)
+
+        self.orderMoves(moves, ply, ttMove)
+        alphaOrig = alpha
+        bestScore = -INFINITY
+        bestMove = None
+        for move in moves:
+            gs.makeMove(move)
+            try:
+                score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)
+            finally:
+                gs.undoMove()
+
+            if score > bestScore:
+                bestScore = score
+                bestMove = move
+                if score > alpha:
+                    alpha = score
+                    self.pv[ply] = [move] + self.pv[ply + 1]
+                    if alpha >= beta:
+                        if not isTactical(move):
+                            self.storeKiller(move, ply)
+                            key = (move.pieceMoved, move.endRow*8 + move.endCol)
+                            self.history[key] = self.history.get(key, 0) + depth * depth
+                        break
+
+        if bestScore <= alphaOrig:
+            bound = UPPER
+        elif bestScore >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.tt.store(gs.hash, bestMove.encode() if bound != UPPER else 0, scoreToTT(bestScore, ply), depth, bound)
+
+        return bestScore
+
+    """
+    Searches captures and promotions only until the position is quiet, so the evaluation
+    is never taken in the middle of an exchange
+    """
+    def quiesce(self, alpha, beta, ply, moves = None):
+        gs = self.gs
+        if moves is None:
+            self.nodes += 1
+            if self.nodes % CHECK_INTERVAL == 0:
+                self.checkLimits()
+            moves = gs.getValidMoves()
+            if not moves:
+                return -MATE + ply if gs.checkMate else 0
+
+        standPat = evaluate(gs)
+        if standPat >= beta or ply >= MAX_PLY:
+            return standPat
+        alpha = max(alpha, standPat)
+
+        captures = [move for move in moves if isTactical(move)]
+        captures.sort(key = self.mvvLva, reverse = True)
+        for move in captures:
+            gs.makeMove(move)
+            try:
+                score = -self.quiesce(-beta, -alpha, ply + 1)
+            finally:
+                gs.undoMove()
+
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    break
+
+        return alpha
+
+    def mvvLva(self, move):
+        score = PIECE_VALUES[move.pieceCaptured[1]] * 10 - PIECE_VALUES[move.pieceMoved[1]] if move.pieceCaptured != "--" else 0
+        if move.isPawnPromotion:
+            score += PIECE_VALUES[move.promotionChoice] * 10
+        return score
+
+    """
+    Orders moves best first: transposition table move, previous principal variation, captures by MVV-LVA,
+    killers, then history score
+    """
+    def orderMoves(self, moves, ply, ttMove = None):
+        pvMove = self.rootPV[ply] if ply < len(self.rootPV) else None
+        killer1, killer2 = self.killers[ply]
+
+        def score(move):
+            if move == ttMove:
+                return 1 << 31
+            if move == pvMove:
+                return 1 << 30
+            if isTactical(move):
+                return (1 << 20) + self.mvvLva(move)
+            if move == killer1:
+                return 1 << 19
+            if move == killer2:
+                return 1 << 18
+            return self.history.get((move.pieceMoved, move.endRow*8 + move.endCol), 0)
+
+        moves.sort(key = score, reverse = True)
+
+    def storeKiller(self, move, ply):
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+
+
+"""
+Searches gs within limits and returns a SearchResult, gs is left as it was.
+tt defaults to a table shared by all searches in this process
+"""
+def bestMove(gs, limits = None, tt = None, tablebase = None):
+    return Searcher(gs, limits, tt, tablebase = tablebase).search()
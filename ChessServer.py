@@ -0,0 +1,395 @@
+"""
+Headless game server: many concurrent games over a newline delimited JSON protocol on TCP, with engine
+searches run in a process pool so the event loop never blocks on them.
+
+    python ChessServer.py serve --port 8765 --workers 4
+    python ChessServer.py load --port 8765 --games 1000 --connections 50
+
+Every request is one JSON object on one line with an "op" and an optional "id" that is copied to the reply.
+The requests of a connection are handled concurrently, so an engine search does not hold up the requests sent
+after it and replies can come back in a different order than the requests, matched to them by id:
+
+    {"id": 1, "op": "new"}                                  start a game, optionally from "fen"
+    {"id": 2, "op": "move", "game": "g1", "move": "e2e4"}   play a move in coordinate notation
+    {"id": 3, "op": "undo", "game": "g1"}
+    {"id": 4, "op": "state", "game": "g1"}
+    {"id": 5, "op": "engine", "game": "g1", "depth": 3, "play": true}
+    {"id": 6, "op": "close", "game": "g1"}
+    {"id": 7, "op": "stats"}
+
+Replies carry "ok": true and the game's "fen", "legalMoves", "status" and "moves" (for engine also "bestMove",
+"eval", "depth", "nodes"), or "ok": false and an "error". Games are not tied to a connection, any client that
+knows a game id can view or play it.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import itertools
+import json
+import math
+import os
+import random
+import signal
+import sys
+import time
+
+import ChessBatch
+import ChessEngine
+import ChessSearch
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+MAX_GAMES = 100000
+#engine requests are clamped to these so one client can't occupy the pool, every search gets the time limit
+MAX_ENGINE_DEPTH = 6
+MAX_ENGINE_MOVETIME = 10.0
+#longest request line accepted
+MAX_LINE = 1 << 16
+
+
+"""
+Runs in a pool process: searches the position of a snapshot and returns the best move encoded
+"""
+def _search(snapshot, history, limits):
+    gs = ChessEngine.GameState.fromSnapshot(snapshot, history)
+    result = ChessSearch.bestMove(gs, limits)
+    return (result.move.encode() if result.move is not None else 0), result.score, result.depth, result.nodes
+
+
+class RequestError(Exception):
+    pass
+
+
+class GameServer():
+    def __init__(self, workers = None, maxGames = MAX_GAMES):
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        self.maxGames = maxGames
+        self.games = {}
+        self.gameIDs = itertools.count(1)
+        self.pool = None
+        self.server = None
+        self.requests = 0
+        self.searches = 0
+        self.connections = 0
+
+    async def start(self, host = DEFAULT_HOST, port = DEFAULT_PORT):
+        self.pool = concurrent.futures.ProcessPoolExecutor(self.workers)
+        self.server = await asyncio.start_server(self.handleConnection, host, port, limit = MAX_LINE)
+        return self.server
+
+    async def serveForever(self, host = DEFAULT_HOST, port = DEFAULT_PORT):
+        await self.start(host, port)
+        #shut the pool down cleanly on SIGTERM too, not only on Ctrl-C
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        except NotImplementedError:
+            pass
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            self.close()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures = True)
+            self.pool = None
+
+    async def handleConnection(self, reader, writer):
+        self.connections += 1
+        #requests still being handled, each one replies when it is done
+        tasks = set()
+        writeLock = asyncio.Lock()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, asyncio.LimitOverrunError):
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                task = asyncio.ensure_future(self.reply(line, writer, writeLock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except ConnectionError:
+            pass
+        finally:
+            #requests read before the client stopped sending still get their replies
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions = True)
+            self.connections -= 1
+            writer.close()
+
+    async def reply(self, line, writer, writeLock):
+        reply = await self.handleLine(line)
+        async with writeLock:
+            writer.write(json.dumps(reply).encode("utf-8") + b"\n")
+            await writer.drain()
+
+    async def handleLine(self, line):
+        self.requests += 1
+        requestID = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise RequestError("request must be a JSON object")
+            requestID = request.get("id")
+            handler = self.handlers.get(request.get("op"))
+            if handler is None:
+                raise RequestError("unknown op %r" % request.get("op"))
+            reply = await handler(self, request)
+            reply["ok"] = True
+        except (RequestError, ValueError) as error:
+            reply = {"ok": False, "error": str(error)}
+        except Exception as error:
+            #a request the handlers did not anticipate must not drop the connection and the requests queued behind it
+            reply = {"ok": False, "error": "internal error: %s" % (str(error) or type(error).__name__)}
+        if requestID is not None:
+            reply["id"] = requestID
+        return reply
+
+    def game(self, request):
+        if not isinstance(request.get("game"), str):
+            raise RequestError("game must be a string")
+        gs = self.games.get(request["game"])
+        if gs is None:
+            raise RequestError("no game %r" % request.get("game"))
+        return gs
+
+    """
+    The reply fields describing a game
+    """
+    def describe(self, gameID, gs):
+        moves = gs.getValidMoves()
+        if gs.checkMate:
+            status = "checkmate"
+        elif gs.staleMate:
+            status = "stalemate"
+        else:
+            status = gs.getDrawReason() or "ongoing"
+        return {
+            "game": gameID,
+            "fen": gs.toFEN(),
+            "status": status,
+            "legalMoves": [move.getChessNotation() for move in moves],
+            "moves": len(gs.moveLog)
+        }
+
+    async def opNew(self, request):
+        if len(self.games) >= self.maxGames:
+            raise RequestError("server is full")
+        if not isinstance(request.get("fen", ""), str):
+            raise RequestError("fen must be a string")
+        gs = ChessEngine.GameState.fromFEN(request["fen"]) if "fen" in request else ChessEngine.GameState()
+        gameID = "g%d" % next(self.gameIDs)
+        self.games[gameID] = gs
+        return self.describe(gameID, gs)
+
+    async def opMove(self, request):
+        gs = self.game(request)
+        if not isinstance(request.get("move"), str):
+            raise RequestError("move must be a string")
+        ChessBatch.playMoves(gs, [request["move"]])
+        return self.describe(request["game"], gs)
+
+    async def opUndo(self, request):
+        gs = self.game(request)
+        if not gs.moveLog:
+            raise RequestError("no move to undo")
+        gs.undoMove()
+        return self.describe(request["game"], gs)
+
+    async def opState(self, request):
+        return self.describe(request["game"], self.game(request))
+
+    async def opEngine(self, request):
+        gs = self.game(request)
+        depth = request.get("depth")
+        movetime = request.get("movetime")
+        if depth is not None and (not isinstance(depth, int) or isinstance(depth, bool) or depth < 1):
+            raise RequestError("depth must be a positive integer")
+        if movetime is not None and (not isinstance(movetime, (int, float)) or isinstance(movetime, bool) or
+                                     not 0 < movetime < math.inf):
+            raise RequestError("movetime must be a positive number")
+        if depth is None and movetime is None:
+            depth = ChessSearch.SearchLimits.DEFAULT_DEPTH
+        limits = ChessSearch.SearchLimits(min(depth, MAX_ENGINE_DEPTH) if depth is not None else None,
+                                          min(float(movetime or MAX_ENGINE_MOVETIME), MAX_ENGINE_MOVETIME))
+        if not gs.getValidMoves():
+            raise RequestError("game is over")
+
+        key = gs.hash
+        history = gs.repetitionHistory()
+        self.searches += 1
+        loop = asyncio.get_running_loop()
+        code, score, depth, nodes = await loop.run_in_executor(self.pool, _search, gs.snapshot(), history, limits)
+
+        #the game may have been moved on by another client while the search ran
+        if gs.hash != key or request["game"] not in self.games:
+            raise RequestError("position changed during the search")
+        move = ChessEngine.Move.fromEncoded(code, gs.board)
+        if request.get("play"):
+            gs.makeMove(move)
+        reply = self.describe(request["game"], gs)
+        reply.update({"bestMove": move.getChessNotation(), "eval": score, "depth": depth, "nodes": nodes})
+        return reply
+
+    async def opClose(self, request):
+        self.game(request)
+        del self.games[request["game"]]
+        return {"game": request["game"]}
+
+    async def opStats(self, request):
+        return {"games": len(self.games), "connections": self.connections, "requests": self.requests,
+                "searches": self.searches, "workers": self.workers}
+
+    handlers = {
+        "new": opNew,
+        "move": opMove,
+        "undo": opUndo,
+        "state": opState,
+        "engine": opEngine,
+        "close": opClose,
+        "stats": opStats
+    }
+
+
+"""
+Client for one connection. Requests can be pipelined, replies are matched to them by id since the server may
+send them out of order
+"""
+class GameClient():
+    def __init__(self):
+        self.reader = None
+        self.writer = None
+        self.pending = {}
+        self.requestIDs = itertools.count(1)
+        self.readTask = None
+
+    async def connect(self, host = DEFAULT_HOST, port = DEFAULT_PORT):
+        self.reader, self.writer = await asyncio.open_connection(host, port, limit = MAX_LINE)
+        self.readTask = asyncio.ensure_future(self.readReplies())
+        return self
+
+    async def readReplies(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                reply = json.loads(line)
+                future = self.pending.pop(reply.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result(reply)
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("connection closed"))
+            self.pending.clear()
+
+    """
+    Sends one request and returns the reply, e.g. await client.request("move", game = "g1", move = "e2e4")
+    """
+    async def request(self, op, **fields):
+        requestID = next(self.requestIDs)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[requestID] = future
+        fields.update({"id": requestID, "op": op})
+        self.writer.write(json.dumps(fields).encode("utf-8") + b"\n")
+        await self.writer.drain()
+        return await future
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+        if self.readTask is not None:
+            await asyncio.gather(self.readTask, return_exceptions = True)
+
+
+async def _playRandomGames(client, games, plies, engineEvery, latencies, rng):
+    for i in range(games):
+        start = time.perf_counter()
+        reply = await client.request("new")
+        latencies.append(time.perf_counter() - start)
+        gameID = reply["game"]
+        for ply in range(plies):
+            if reply["status"] != "ongoing" or not reply["legalMoves"]:
+                break
+            start = time.perf_counter()
+            if engineEvery and ply % engineEvery == engineEvery - 1:
+                reply = await client.request("engine", game = gameID, depth = 1, play = True)
+            else:
+                reply = await client.request("move", game = gameID, move = rng.choice(reply["legalMoves"]))
+            latencies.append(time.perf_counter() - start)
+            if not reply["ok"]:
+                raise RuntimeError(reply["error"])
+        await client.request("close", game = gameID)
+
+
+"""
+Plays games random games of plies moves over connections connections at once, every engineEvery-th move is
+asked of the engine. Returns the request count, requests per second and latency percentiles
+"""
+async def loadTest(host = DEFAULT_HOST, port = DEFAULT_PORT, games = 100, connections = 10, plies = 40, engineEvery = 0, seed = 0):
+    clients = [await GameClient().connect(host, port) for i in range(connections)]
+    latencies = []
+    rng = random.Random(seed)
+    share = [games // connections + (1 if i < games % connections else 0) for i in range(connections)]
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(_playRandomGames(client, count, plies, engineEvery, latencies, random.Random(rng.random()))
+                               for client, count in zip(clients, share)))
+    finally:
+        for client in clients:
+            await client.close()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    percentile = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else 0.0
+    return {
+        "requests": len(latencies),
+        "seconds": elapsed,
+        "requestsPerSecond": len(latencies) / elapsed if elapsed else 0.0,
+        "p50ms": percentile(0.5),
+        "p99ms": percentile(0.99)
+    }
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Headless chess game server")
+    commands = parser.add_subparsers(dest = "command", required = True)
+    serve = commands.add_parser("serve", help = "run the server")
+    serve.add_argument("--host", default = DEFAULT_HOST)
+    serve.add_argument("--port", type = int, default = DEFAULT_PORT)
+    serve.add_argument("--workers", type = int, default = None, help = "engine search processes")
+    serve.add_argument("--max-games", type = int, default = MAX_GAMES)
+    load = commands.add_parser("load", help = "play random games against a running server")
+    load.add_argument("--host", default = DEFAULT_HOST)
+    load.add_argument("--port", type = int, default = DEFAULT_PORT)
+    load.add_argument("--games", type = int, default = 100)
+    load.add_argument("--connections", type = int, default = 10)
+    load.add_argument("--plies", type = int, default = 40)
+    load.add_argument("--engine-every", type = int, default = 0, help = "let the engine play every n-th move")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        try:
+            asyncio.run(GameServer(args.workers, args.max_games).serveForever(args.host, args.port))
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            pass
+        return 0
+
+    print(json.dumps(asyncio.run(loadTest(args.host, args.port, args.games, args.connections, args.plies, args.engine_every))))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,540 @@
+"""
+Endgame tablebases for positions with up to four pieces, kings included.
+
+A table holds, for every position of one material signature ("KQvK", "KPvK", "KBNvK", "KQvKR", ...), whether
+the side to move wins, draws or loses and in how many plies mate comes with best play (distance to mate).
+Tables are built by retrograde analysis: mates are found first, then positions one ply further away, until
+nothing changes. Captures and promotions lead into smaller tables, which are built first.
+
+    python ChessTablebase.py generate KQvK KRvK KPvK KBNvK --dir tablebases
+    python ChessTablebase.py probe --fen "8/8/8/4k3/8/8/8/4K2Q w - - 0 1" --dir tablebases
+
+    tablebase = ChessTablebase.Tablebase("tablebases")
+    wdl, dtm = tablebase.probe(gs)        # None when gs has no table
+
+Each table is stored in <signature>.tb as MAGIC, the signature and one zlib compressed byte per position: DRAW,
+a win in 1 to MAX_DTM plies, LOSS plus the plies to being mated, or ILLEGAL. Pawnless tables keep only
+positions with the white king in the a1-d1-d4 triangle, tables with pawns only those with the white king on
+files a to d, all other positions are mirrored into those.
+
+Castling is not possible with so few pieces, en passant captures are ignored by the tables and positions where
+one is possible are not probed. The fifty move rule is not taken into account.
+"""
+import argparse
+import os
+import struct
+import sys
+import time
+import zlib
+
+from ChessBitboard import (SQUARE_BB, KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, ROOK_RAY_MASK, BISHOP_RAY_MASK,
+                           rookAttacks, bishopAttacks, squares, popCount)
+from ChessZobrist import castleMask
+
+MAGIC = b"CHESSTB1"
+MAX_PIECES = 4
+EXTENSION = ".tb"
+
+DRAW = 0
+LOSS = 128
+MAX_DTM = 126
+ILLEGAL = 255
+
+PIECE_ORDER = "KQRBNP"
+PIECE_WORTH = {"K": 0, "Q": 9, "R": 5, "B": 3, "N": 3, "P": 1}
+
+#material that cannot mate at all, these need no table
+DRAWN_SIGNATURES = {"KvK", "KBvK", "KNvK"}
+
+#every 3 piece ending that is not a dead draw
+THREE_PIECE_TABLES = ["KQvK", "KRvK", "KPvK"]
+
+
+def _transform(mapping):
+    return [mapping(sq >> 3, sq & 7) for sq in range(64)]
+
+
+#the eight symmetries of the board, only the first two (identity and left-right mirror) keep pawns moving the same way
+TRANSFORMS = [
+    _transform(lambda r, c: r*8 + c),
+    _transform(lambda r, c: r*8 + 7 - c),
+    _transform(lambda r, c: (7 - r)*8 + c),
+    _transform(lambda r, c: (7 - r)*8 + 7 - c),
+    _transform(lambda r, c: c*8 + r),
+    _transform(lambda r, c: c*8 + 7 - r),
+    _transform(lambda r, c: (7 - c)*8 + r),
+    _transform(lambda r, c: (7 - c)*8 + 7 - r)
+]
+FLIP = TRANSFORMS[2]
+
+#a1-d1-d4 triangle in board coordinates (row 7 is rank 1)
+TRIANGLE = [r*8 + c for r in range(4, 8) for c in range(4) if 7 - r <= c]
+QUEENSIDE = [r*8 + c for r in range(8) for c in range(4)]
+
+
+"""
+Splits a signature like "KBNvK" into its white and black pieces
+"""
+def parseSignature(signature):
+    white, separator, black = signature.partition("v")
+    for side in (white, black):
+        if (not separator or not side or side[0] != "K" or side.count("K") != 1 or any(piece not in PIECE_ORDER for piece in side) or
+                list(side) != sorted(side, key = PIECE_ORDER.index)):
+            raise ValueError("bad signature " + signature)
+    if len(white) + len(black) > MAX_PIECES:
+        raise ValueError("tables have at most %d pieces, not %s" % (MAX_PIECES, signature))
+    return white, black
+
+
+def _strength(side):
+    return (sum(PIECE_WORTH[piece] for piece in side), [-PIECE_ORDER.index(piece) for piece in side])
+
+
+"""
+Returns the signature of a table for the given white and black pieces, and if the colors are swapped in it.
+Tables are always stored with the stronger side as white
+"""
+def tableSignature(white, black):
+    white = "".join(sorted(white, key = PIECE_ORDER.index))
+    black = "".join(sorted(black, key = PIECE_ORDER.index))
+    if _strength(black) > _strength(white):
+        return black + "v" + white, True
+    return white + "v" + black, False
+
+
+"""
+The piece list of a signature and how positions are numbered: side to move, then the white king's square among
+the squares it is kept on, then one square (0-63) for every other piece
+"""
+class Layout():
+    def __init__(self, signature):
+        white, black = parseSignature(signature)
+        self.signature = signature
+        self.pieces = [(True, piece) for piece in white] + [(False, piece) for piece in black]
+        self.hasPawns = "P" in signature
+        self.kingSquares = QUEENSIDE if self.hasPawns else TRIANGLE
+        self.kingIndex = {sq: i for i, sq in enumerate(self.kingSquares)}
+        self.size = len(self.kingSquares) * 64 ** (len(self.pieces) - 1)
+
+        #symmetries that move a white king on each square into kingSquares
+        transforms = TRANSFORMS[:2] if self.hasPawns else TRANSFORMS
+        self.kingTransforms = [[t for t in transforms if t[sq] in self.kingIndex] for sq in range(64)]
+
+        #runs of identical pieces, their squares are kept sorted so a position has a single index
+        self.groups = []
+        start = 0
+        for i in range(1, len(self.pieces) + 1):
+            if i == len(self.pieces) or self.pieces[i] != self.pieces[start]:
+                if i - start > 1:
+                    self.groups.append((start, i))
+                start = i
+
+    def index(self, sqs, whiteToMove):
+        best = None
+        for t in self.kingTransforms[sqs[0]]:
+            mapped = [t[sq] for sq in sqs]
+            for start, end in self.groups:
+                mapped[start:end] = sorted(mapped[start:end])
+            i = self.kingIndex[mapped[0]]
+            for sq in mapped[1:]:
+                i = i*64 + sq
+            if best is None or i < best:
+                best = i
+        return best if whiteToMove else best + self.size
+
+    def decode(self, index):
+        whiteToMove = index < self.size
+        index = index if whiteToMove else index - self.size
+        sqs = []
+        for i in range(len(self.pieces) - 1):
+            index, sq = divmod(index, 64)
+            sqs.append(sq)
+        sqs.append(self.kingSquares[index])
+        sqs.reverse()
+        return sqs, whiteToMove
+
+
+def _attacked(target, byWhite, pieces, sqs, occupied):
+    bit = SQUARE_BB[target]
+    for (white, piece), sq in zip(pieces, sqs):
+        if white != byWhite or sq < 0:
+            continue
+        if piece == "K":
+            hit = KING_ATTACKS[sq] & bit
+        elif piece == "N":
+            hit = KNIGHT_ATTACKS[sq] & bit
+        elif piece == "P":
+            hit = PAWN_ATTACKS["w" if white else "b"][sq] & bit
+        else:
+            hit = 0
+            if piece != "B" and ROOK_RAY_MASK[sq] & bit:
+                hit = rookAttacks(sq, occupied) & bit
+            if not hit and piece != "R" and BISHOP_RAY_MASK[sq] & bit:
+                hit = bishopAttacks(sq, occupied) & bit
+        if hit:
+            return True
+    return False
+
+
+"""
+Returns the legal moves of the side to move as (piece index, target square, captured piece index or -1,
+promotion or None, squares after the move with the captured piece at -1). A promoting pawn gives four moves
+"""
+def _legalMoves(pieces, sqs, whiteToMove):
+    occupied = own = 0
+    owner = {}
+    kingSq = -1
+    for i, ((white, piece), sq) in enumerate(zip(pieces, sqs)):
+        occupied |= SQUARE_BB[sq]
+        owner[sq] = i
+        if white == whiteToMove:
+            own |= SQUARE_BB[sq]
+            if piece == "K":
+                kingSq = sq
+    enemy = occupied ^ own
+
+    moves = []
+    for i, ((white, piece), sq) in enumerate(zip(pieces, sqs)):
+        if white != whiteToMove:
+            continue
+        if piece == "P":
+            targets = []
+            step = -8 if white else 8
+            if not occupied & SQUARE_BB[sq + step]:
+                targets.append(sq + step)
+                if sq >> 3 == (6 if white else 1) and not occupied & SQUARE_BB[sq + 2*step]:
+                    targets.append(sq + 2*step)
+            targets.extend(squares(PAWN_ATTACKS["w" if white else "b"][sq] & enemy))
+        elif piece == "K":
+            targets = squares(KING_ATTACKS[sq] & ~own)
+        elif piece == "N":
+            targets = squares(KNIGHT_ATTACKS[sq] & ~own)
+        elif piece == "B":
+            targets = squares(bishopAttacks(sq, occupied) & ~own)
+        elif piece == "R":
+            targets = squares(rookAttacks(sq, occupied) & ~own)
+        else:
+            targets = squares((rookAttacks(sq, occupied) | bishopAttacks(sq, occupied)) & ~own)
+
+        for to in targets:
+            captured = owner.get(to, -1)
+            after = list(sqs)
+            after[i] = to
+            if captured >= 0:
+                after[captured] = -1
+            if _attacked(to if piece == "K" else kingSq, not whiteToMove, pieces, after, (occupied ^ SQUARE_BB[sq]) | SQUARE_BB[to]):
+                continue
+            if piece == "P" and to >> 3 in (0, 7):
+                for promotion in "QRBN":
+                    moves.append((i, to, captured, promotion, after))
+            else:
+                moves.append((i, to, captured, None, after))
+    return moves
+
+
+"""
+Loads tables from a directory on first use. With generate, missing tables are built and saved there
+"""
+class Tablebase():
+    def __init__(self, directory = ".", generate = False):
+        self.directory = directory
+        self.generate = generate
+        self.tables = {}
+        self.maxPieces = 0
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name.endswith(EXTENSION):
+                    self.maxPieces = max(self.maxPieces, len(name) - len(EXTENSION) - 1)
+
+    def path(self, signature):
+        return os.path.join(self.directory, signature + EXTENSION)
+
+    """
+    Returns the (Layout, values) of a table, or None if it is neither on disk nor to be generated
+    """
+    def table(self, signature):
+        if signature not in self.tables:
+            path = self.path(signature)
+            if os.path.exists(path):
+                self.tables[signature] = (Layout(signature), readTable(path, signature))
+            elif self.generate:
+                layout = Layout(signature)
+                values = TableGenerator(layout, self).run()
+                os.makedirs(self.directory, exist_ok = True)
+                writeTable(path, signature, values)
+                self.tables[signature] = (layout, values)
+                self.maxPieces = max(self.maxPieces, len(layout.pieces))
+            else:
+                self.tables[signature] = None
+        return self.tables[signature]
+
+    """
+    Returns the stored value of a position given as lists of (white, piece) and squares, from the side to move's
+    point of view, or None without a table
+    """
+    def probePieces(self, pieces, sqs, whiteToMove):
+        white = "".join(piece for isWhite, piece in pieces if isWhite)
+        black = "".join(piece for isWhite, piece in pieces if not isWhite)
+        signature, swapped = tableSignature(white, black)
+        if signature in DRAWN_SIGNATURES:
+            return DRAW
+        table = self.table(signature)
+        if table is None:
+            return None
+        layout, values = table
+
+        if swapped:
+            pieces = [(not isWhite, piece) for isWhite, piece in pieces]
+            sqs = [FLIP[sq] for sq in sqs]
+            whiteToMove = not whiteToMove
+        order = sorted(range(len(pieces)), key = lambda i: (not pieces[i][0], PIECE_ORDER.index(pieces[i][1])))
+        return values[layout.index([sqs[i] for i in order], whiteToMove)]
+
+    """
+    Probes gs: returns (wdl, dtm) with wdl 1, 0 or -1 for a win, draw or loss of the side to move and dtm the
+    plies to mate, or None if gs has too many pieces, castling rights, an en passant capture or no table
+    """
+    def probe(self, gs):
+        occupied = gs.colorBitboards["w"] | gs.colorBitboards["b"]
+        if popCount(occupied) > MAX_PIECES or castleMask(gs.currentCastlingRights):
+            return None
+        if gs.enpassantPossible != ():
+            epRow, epCol = gs.enpassantPossible
+            pawns = gs.bitboards["wP" if gs.whiteToMove else "bP"]
+            if PAWN_ATTACKS["b" if gs.whiteToMove else "w"][epRow*8 + epCol] & pawns:
+                return None
+
+        pieces = []
+        sqs = []
+        for name, bitboard in gs.bitboards.items():
+            for sq in squares(bitboard):
+                pieces.append((name[0] == "w", name[1]))
+                sqs.append(sq)
+        value = self.probePieces(pieces, sqs, gs.whiteToMove)
+        if value is None or value == ILLEGAL:
+            return None
+        if value == DRAW:
+            return 0, 0
+        if value < LOSS:
+            return 1, value
+        return -1, value - LOSS
+
+
+"""
+Builds one table by retrograde analysis, probing the smaller tables that captures and promotions lead to
+through tablebase
+"""
+class TableGenerator():
+    def __init__(self, layout, tablebase):
+        self.layout = layout
+        self.tablebase = tablebase
+        total = 2 * layout.size
+        self.values = bytearray([ILLEGAL]) * total
+        #set when a capture or promotion saves the side to move from losing
+        self.escape = bytearray(total)
+        #plies to mate after the slowest capture or promotion that loses
+        self.conversionLoss = bytearray(total)
+        self.pending = bytearray(total)
+        #positions to resolve at each distance to mate, as (index, win)
+        self.buckets = {}
+
+    def add(self, level, index, win):
+        if level > MAX_DTM:
+            raise ValueError("distance to mate over %d plies in %s" % (MAX_DTM, self.layout.signature))
+        self.buckets.setdefault(level, []).append((index, win))
+
+    def convert(self, sqs, move):
+        i, to, captured, promotion, after = move
+        pieces = self.layout.pieces
+        children = []
+        childSqs = []
+        for j, (piece, sq) in enumerate(zip(pieces, after)):
+            if j == captured:
+                continue
+            children.append((piece[0], promotion) if j == i and promotion else piece)
+            childSqs.append(sq)
+        value = self.tablebase.probePieces(children, childSqs, not pieces[i][0])
+        if value is None:
+            raise ValueError("no table for a conversion of " + self.layout.signature)
+        return value
+
+    def initialise(self):
+        layout = self.layout
+        pieces = layout.pieces
+        values = self.values
+        for index in range(2 * layout.size):
+            sqs, whiteToMove = layout.decode(index)
+            if len(set(sqs)) < len(sqs) or layout.index(sqs, whiteToMove) != index:
+                continue
+            if any(piece == "P" and sq >> 3 in (0, 7) for (white, piece), sq in zip(pieces, sqs)):
+                continue
+            occupied = 0
+            for sq in sqs:
+                occupied |= SQUARE_BB[sq]
+            kings = [sq for (white, piece), sq in zip(pieces, sqs) if piece == "K"]
+            if _attacked(kings[1] if whiteToMove else kings[0], whiteToMove, pieces, sqs, occupied):
+                continue
+            values[index] = DRAW
+
+            moves = _legalMoves(pieces, sqs, whiteToMove)
+            if not moves:
+                #mate, stalemates stay drawn
+                if _attacked(kings[0] if whiteToMove else kings[1], not whiteToMove, pieces, sqs, occupied):
+                    self.add(0, index, False)
+                continue
+
+            quiet = 0
+            fastestWin = None
+            for move in moves:
+                if move[2] < 0 and move[3] is None:
+                    quiet += 1
+                    continue
+                value = self.convert(sqs, move)
+                if value == DRAW:
+                    self.escape[index] = 1
+                elif value >= LOSS:
+                    self.escape[index] = 1
+                    fastestWin = value - LOSS + 1 if fastestWin is None else min(fastestWin, value - LOSS + 1)
+                else:
+                    self.conversionLoss[index] = max(self.conversionLoss[index], value + 1)
+            if fastestWin is not None:
+                self.add(fastestWin, index, True)
+            elif not quiet and not self.escape[index]:
+                self.pending[index] = 1
+                self.add(self.conversionLoss[index], index, False)
+
+    """
+    Returns the distance to mate if every move from a position loses, or -1
+    """
+    def lossLevel(self, index):
+        if self.escape[index]:
+            return -1
+        layout = self.layout
+        sqs, whiteToMove = layout.decode(index)
+        level = self.conversionLoss[index]
+        for i, to, captured, promotion, after in _legalMoves(layout.pieces, sqs, whiteToMove):
+            if captured >= 0 or promotion:
+                continue
+            value = self.values[layout.index(after, not whiteToMove)]
+            if value == DRAW or value >= LOSS:
+                return -1
+            level = max(level, value + 1)
+        return level
+
+    """
+    Yields the positions with the other side to move that lead to index by a move that is not a capture or promotion
+    """
+    def predecessors(self, index):
+        layout = self.layout
+        pieces = layout.pieces
+        sqs, whiteToMove = layout.decode(index)
+        occupied = 0
+        for sq in sqs:
+            occupied |= SQUARE_BB[sq]
+        empty = ~occupied
+        for i, ((white, piece), sq) in enumerate(zip(pieces, sqs)):
+            if white == whiteToMove:
+                continue
+            if piece == "P":
+                origins = []
+                back = 8 if white else -8
+                if 1 <= (sq + back) >> 3 <= 6 and empty & SQUARE_BB[sq + back]:
+                    origins.append(sq + back)
+                    if sq >> 3 == (4 if white else 3) and empty & SQUARE_BB[sq + 2*back]:
+                        origins.append(sq + 2*back)
+            elif piece == "K":
+                origins = squares(KING_ATTACKS[sq] & empty)
+            elif piece == "N":
+                origins = squares(KNIGHT_ATTACKS[sq] & empty)
+            elif piece == "B":
+                origins = squares(bishopAttacks(sq, occupied) & empty)
+            elif piece == "R":
+                origins = squares(rookAttacks(sq, occupied) & empty)
+            else:
+                origins = squares((rookAttacks(sq, occupied) | bishopAttacks(sq, occupied)) & empty)
+            for origin in origins:
+                before = list(sqs)
+                before[i] = origin
+                yield layout.index(before, not whiteToMove)
+
+    def run(self):
+        self.initialise()
+        values = self.values
+        pending = self.pending
+        level = 0
+        while self.buckets:
+            current = []
+            for index, win in self.buckets.pop(level, []):
+                if values[index] == DRAW:
+                    values[index] = level if win else LOSS + level
+                    current.append(index)
+            for index in current:
+                lost = values[index] >= LOSS
+                for previous in self.predecessors(index):
+                    if values[previous] != DRAW or pending[previous]:
+                        continue
+                    if lost:
+                        pending[previous] = 1
+                        self.add(level + 1, previous, True)
+                    else:
+                        lossLevel = self.lossLevel(previous)
+                        if lossLevel >= 0:
+                            pending[previous] = 1
+                            self.add(lossLevel, previous, False)
+            level += 1
+        return bytes(values)
+
+
+def writeTable(path, signature, values):
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack(">B", len(signature)))
+        f.write(signature.encode("ascii"))
+        f.write(zlib.compress(values, 9))
+
+
+def readTable(path, signature):
+    with open(path, "rb") as f:
+        data = f.read()
+    length = data[len(MAGIC)] if len(data) > len(MAGIC) else 0
+    stored = data[len(MAGIC) + 1:len(MAGIC) + 1 + length].decode("ascii", "replace")
+    if data[:len(MAGIC)] != MAGIC or stored != signature:
+        raise ValueError("not a table for %s: %s" % (signature, path))
+    values = zlib.decompress(data[len(MAGIC) + 1 + length:])
+    if len(values) != 2 * Layout(signature).size:
+        raise ValueError("truncated table " + path)
+    return values
+
+
+def main(argv = None):
+    import ChessEngine
+
+    parser = argparse.ArgumentParser(description = "Generate or probe endgame tablebases")
+    commands = parser.add_subparsers(dest = "command", required = True)
+    generate = commands.add_parser("generate", help = "build tables, and the smaller tables they need")
+    generate.add_argument("signatures", nargs = "*", default = THREE_PIECE_TABLES, help = "e.g. KQvK KBNvK")
+    generate.add_argument("--dir", default = ".")
+    probe = commands.add_parser("probe", help = "look a position up")
+    probe.add_argument("--fen", required = True)
+    probe.add_argument("--dir", default = ".")
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        tablebase = Tablebase(args.dir, generate = True)
+        for signature in args.signatures:
+            start = time.perf_counter()
+            tablebase.table(tableSignature(*parseSignature(signature))[0])
+            print("%s done in %.1fs" % (signature, time.perf_counter() - start))
+        return 0
+
+    result = Tablebase(args.dir).probe(ChessEngine.GameState.fromFEN(args.fen))
+    if result is None:
+        print("not in the tablebase")
+    else:
+        wdl, dtm = result
+        print(("draw" if wdl == 0 else "win" if wdl > 0 else "loss") + ("" if wdl == 0 else " in %d plies" % dtm))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+"""
+Fixed-size transposition table keyed by the zobrist hash of a position.
+
+Entries are two 64-bit words in one flat buffer, so the memory used is fixed when the table is created
+and the buffer can live in shared memory. Each bucket holds BUCKET_SIZE entries, the first word of an entry
+is the key xored with the data, which lets a reader spot an entry that was half written by another process
+"""
+
+EXACT = 1
+LOWER = 2
+UPPER = 3
+
+DEPTH_PREFERRED = "depth"
+ALWAYS_REPLACE = "always"
+
+ENTRY_BYTES = 16
+BUCKET_SIZE = 4
+
+#data word layout: move (16 bits), score (20 bits, offset), depth (8 bits), generation (8 bits), bound (2 bits)
+SCORE_OFFSET = 1 << 19
+SCORE_MASK = (1 << 20) - 1
+
+
+def _pack(move, score, depth, generation, bound):
+    return (move | ((score + SCORE_OFFSET) & SCORE_MASK) << 16 | (depth & 0xff) << 36 |
+            (generation & 0xff) << 44 | bound << 52)
+
+
+"""
+Bytes used by a table of at most sizeMB megabytes, rounded down to a power of two number of buckets
+so the bucket index is a mask
+"""
+def tableSize(sizeMB):
+    buckets = 1
+    while buckets * 2 * BUCKET_SIZE * ENTRY_BYTES <= sizeMB * 1024 * 1024:
+        buckets *= 2
+    return buckets * BUCKET_SIZE * ENTRY_BYTES
+
+
+class TTEntry():
+    __slots__ = ("move", "score", "depth", "bound", "generation")
+
+    def __init__(self, data):
+        self.move = data & 0xffff
+        self.score = ((data >> 16) & SCORE_MASK) - SCORE_OFFSET
+        self.depth = (data >> 36) & 0xff
+        self.generation = (data >> 44) & 0xff
+        self.bound = (data >> 52) & 3
+
+
+class TranspositionTable():
+    def __init__(self, sizeMB = 16, policy = DEPTH_PREFERRED, buffer = None):
+        if policy not in (DEPTH_PREFERRED, ALWAYS_REPLACE):
+            raise ValueError("unknown replacement policy: " + str(policy))
+        self.policy = policy
+
+        self.size = tableSize(sizeMB)
+        self.bucketMask = self.size // (BUCKET_SIZE * ENTRY_BYTES) - 1
+
+        if buffer is None:
+            buffer = bytearray(self.size)
+        self.buffer = memoryview(buffer)[:self.size]
+        self.words = self.buffer.cast("Q")
+
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.replacements = 0
+
+    """
+    Starts a new search, entries from earlier searches become candidates for replacement
+    """
+    def newSearch(self):
+        self.generation = (self.generation + 1) & 0xff
+
+    def clear(self):
+        self.buffer[:] = bytes(self.size)
+        self.generation = 0
+        self.resetStats()
+
+    """
+    Releases the views on the buffer, needed before a shared memory buffer can be closed
+    """
+    def release(self):
+        self.words.release()
+        self.buffer.release()
+
+    def resetStats(self):
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.replacements = 0
+
+    """
+    Returns the TTEntry stored for key, or None
+    """
+    def probe(self, key):
+        self.probes += 1
+        words = self.words
+        base = (key & self.bucketMask) * BUCKET_SIZE * 2
+        for i in range(base, base + BUCKET_SIZE * 2, 2):
+            data = words[i + 1]
+            if data and words[i] ^ data == key:
+                self.hits += 1
+                return TTEntry(data)
+        return None
+
+    def store(self, key, move, score, depth, bound):
+        words = self.words
+        generation = self.generation
+        base = (key & self.bucketMask) * BUCKET_SIZE * 2
+        target = base
+        lowest = None
+
+        for i in range(base, base + BUCKET_SIZE * 2, 2):
+            data = words[i + 1]
+            if data and words[i] ^ data == key:
+                #same position: keep a deeper result from the current search unless the new one is exact
+                if (self.policy == DEPTH_PREFERRED and bound != EXACT and
+                        (data >> 44) & 0xff == generation and (data >> 36) & 0xff > depth):
+                    return
+                if not move:
+                    move = data & 0xffff
+                target = i
+                break
+
+            #otherwise the least useful entry goes: empty slots, then old generations, then shallow depths
+            if not data:
+                value = -(1 << 16)
+            else:
+                age = (generation - ((data >> 44) & 0xff)) & 0xff
+                value = ((data >> 36) & 0xff) - 8 * age if self.policy == DEPTH_PREFERRED else -age
+            if lowest is None or value < lowest:
+                target = i
+                lowest = value
+        else:
+            if words[target + 1]:
+                self.replacements += 1
+
+        self.stores += 1
+        data = _pack(move, score, depth, generation, bound)
+        words[target] = key ^ data
+        words[target + 1] = data
+
+    def hitRate(self):
+        return self.hits / self.probes if self.probes else 0.0
+
+    """
+    Permille of a sample of entries that were written during the current search
+    """
+    def hashfull(self):
+        sample = min(1000, len(self.words) // 2)
+        used = 0
+        for i in range(0, sample * 2, 2):
+            data = self.words[i + 1]
+            if data and (data >> 44) & 0xff == self.generation:
+                used += 1
+        return used * 1000 // sample if sample else 0
+
+    def stats(self):
+        return {
+            "sizeBytes": self.size,
+            "entries": len(self.words) // 2,
+            "policy": self.policy,
+            "probes": self.probes,
+            "hits": self.hits,
+            "misses": self.probes - self.hits,
+            "hitRate": self.hitRate(),
+            "stores": self.stores,
+            "replacements": self.replacements,
+            "hashfull": self.hashfull()
+        }
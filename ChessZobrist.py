@@ -0,0 +1,45 @@
+"""
+Zobrist keys for hashing positions. A position's hash is the xor of a key for every piece on its square,
+the side to move, the castling rights and the enpassant file; GameState keeps it up to date incrementally
+"""
+import random
+
+#fixed seed so hashes are stable across runs and processes
+_random = random.Random(0x5EED)
+
+
+def _key():
+    return _random.getrandbits(64)
+
+
+#PIECE_KEYS[piece][row*8 + col], empty squares hash to 0
+PIECE_KEYS = {color + piece: [_key() for sq in range(64)] for color in "wb" for piece in ["P", "R", "N", "B", "Q", "K"]}
+PIECE_KEYS["--"] = [0] * 64
+
+BLACK_TO_MOVE_KEY = _key()
+
+#one key per castling right, CASTLE_KEYS is indexed by the castleMask of a set of rights
+WKS_KEY, BKS_KEY, WQS_KEY, BQS_KEY = _key(), _key(), _key(), _key()
+CASTLE_KEYS = [(WKS_KEY if mask & 1 else 0) ^ (BKS_KEY if mask & 2 else 0) ^
+               (WQS_KEY if mask & 4 else 0) ^ (BQS_KEY if mask & 8 else 0) for mask in range(16)]
+
+#indexed by the column of the enpassant square
+ENPASSANT_KEYS = [_key() for col in range(8)]
+
+
+"""
+Packs castling rights into 4 bits: wks, bks, wqs, bqs
+"""
+def castleMask(rights):
+    return rights.wks | (rights.bks << 1) | (rights.wqs << 2) | (rights.bqs << 3)
+
+
+"""
+Computes the hash of a position from scratch
+"""
+def computeHash(gs):
+    h = 0
+    for r in range(8):
+        for c in range(8):
+            h ^= PIECE_KEYS[gs.board[r][c]][r*8 + c]
+    return h ^ gs.stateHash()